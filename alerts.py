@@ -0,0 +1,186 @@
+import base64
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+import cv2 as cv
+import requests
+from requests.adapters import HTTPAdapter
+
+from clips import thumbnail_strip
+from metrics import timed
+
+class AlertDispatcher:
+    # background alert delivery: submit() only enqueues, the worker thread does
+    # the resize/JPEG/base64 encoding and posts over one pooled session.
+    # undeliverable alerts are appended to a JSONL spool and replayed later.
+    def __init__(self, api_url, spool_path="alerts.spool", batch_size=1, batch_wait=0.5, retries=3,
+                 backoff=0.5, timeout=5, queue_size=256, scale=0.5, dry_run=False, session=None,
+                 verbose=True, metrics=None):
+        self.api_url = api_url
+        self.spool_path = spool_path
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.scale = scale
+        # dry_run prints alerts instead of posting them
+        self.dry_run = dry_run
+        self.verbose = verbose
+        self.metrics = metrics
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.spool_lock = threading.Lock()
+        self.stop = threading.Event()
+        self.last_frame = None
+        self.last_image = None
+        self.sent = 0
+        self.spooled = 0
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, payload, frame=None):
+        # the frame must not be drawn on by the caller after submitting
+        try:
+            self.queue.put_nowait((dict(payload), frame))
+        except queue.Full:
+            # only the worker encodes: keep the event, without its images,
+            # rather than stall the caller (or race the worker's last_image)
+            payload = {key: value for key, value in payload.items() if key not in ("clip", "clip_times", "strip")}
+            self.spool([dict(payload, image=None)])
+            if self.metrics is not None:
+                self.metrics.count("alerts_overflow")
+
+    def encode(self, payload, frame):
+        payload = dict(payload)
+        if frame is not None:
+            with timed(self.metrics, "alert_encoding"):
+                # several rules firing on one frame share one encode
+                if frame is not self.last_frame:
+                    self.last_frame = frame
+                    if self.scale != 1:
+                        frame = cv.resize(frame, (0, 0), fx=self.scale, fy=self.scale)
+                    self.last_image = self.encode_image(frame)
+                payload["image"] = self.last_image
+        # clips.ClipRecorder attachments: frames or pre-encoded JPEG bytes,
+        # and the frames of a strip are stitched into one image here
+        if payload.get("clip") is not None:
+            payload["clip"] = [self.encode_image(data) for data in payload["clip"]]
+        if isinstance(payload.get("strip"), list):
+            payload["strip"] = thumbnail_strip(payload["strip"], len(payload["strip"]))
+        if payload.get("strip") is not None:
+            payload["strip"] = self.encode_image(payload["strip"])
+        return payload
+
+    def encode_image(self, data):
+        if not isinstance(data, bytes):
+            data = cv.imencode('.jpg', data)[1].tobytes()
+        return base64.b64encode(data).decode('utf-8')
+
+    def next_batch(self):
+        try:
+            items = [self.queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.batch_wait
+        while len(items) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def run(self):
+        while not (self.stop.is_set() and self.queue.empty()):
+            items = self.next_batch()
+            if not items:
+                continue
+            try:
+                payloads = [self.encode(payload, frame) for payload, frame in items]
+                if self.deliver(payloads):
+                    self.replay()
+                else:
+                    self.spool(payloads)
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+
+    def deliver(self, payloads):
+        if self.dry_run:
+            for payload in payloads if self.verbose else ():
+                summary = {key: f"<{len(value)} bytes>" for key in ("image", "strip") if (value := payload.get(key))}
+                if payload.get("clip"):
+                    summary["clip"] = f"<{len(payload['clip'])} frames>"
+                print(f"Alert Sent: {dict(payload, **summary)}")
+            self.sent += len(payloads)
+            return True
+        body = payloads[0] if len(payloads) == 1 else payloads
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.post(self.api_url, json=body, timeout=self.timeout)
+                response.raise_for_status()
+                self.sent += len(payloads)
+                return True
+            except requests.exceptions.RequestException as e:
+                if self.verbose:
+                    print(f"API call failed ({attempt + 1}/{self.retries + 1}): {e}")
+                if attempt < self.retries:
+                    time.sleep(self.backoff * 2 ** attempt)
+        return False
+
+    def spool(self, payloads):
+        with self.spool_lock:
+            with open(self.spool_path, "a") as f:
+                for payload in payloads:
+                    f.write(json.dumps(payload) + "\n")
+            self.spooled += len(payloads)
+
+    def replay(self):
+        # resend spooled alerts once the endpoint is reachable again
+        with self.spool_lock:
+            if not os.path.exists(self.spool_path):
+                return
+            replaying = self.spool_path + ".replay"
+            os.replace(self.spool_path, replaying)
+        with open(replaying) as f:
+            payloads = [json.loads(line) for line in f if line.strip()]
+        failed = []
+        for i in range(0, len(payloads), self.batch_size):
+            batch = payloads[i:i + self.batch_size]
+            if failed or not self.deliver(batch):
+                failed.extend(batch)
+        os.remove(replaying)
+        if failed:
+            self.spool(failed)
+            self.spooled -= len(failed)
+
+    def flush(self):
+        self.queue.join()
+
+    def close(self):
+        self.stop.set()
+        self.worker.join()
+        self.session.close()
+
+def default_dispatcher(alerts=None, api_url=None):
+    # the scenario scripts' dispatcher unless one is passed in: encoding and
+    # posting happen off the detection loop, printed instead of posted
+    return alerts if alerts is not None else AlertDispatcher(api_url, dry_run=True)
+
+def draw_and_submit(alerts, template, frame, draw, headless=False, fire=False):
+    # draw(frame) annotates in place and returns the frame. headless: only
+    # the frame that goes out with the alert is drawn on, as a copy
+    if not headless:
+        draw(frame)
+    if fire:
+        snapshot = frame if not headless else draw(frame.copy())
+        alerts.submit(dict(template, event_date=datetime.datetime.now().isoformat()), snapshot)
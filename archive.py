@@ -0,0 +1,310 @@
+import argparse
+import datetime
+import itertools
+import json
+import multiprocessing
+import os
+import time
+import cv2 as cv
+import numpy as np
+
+from cache import DetectionCache
+from filtering import CLASS_ID, ID
+from rules import rules_from_config
+from tracks import iou
+
+# offline analysis of recordings: the expensive part (decode, inference,
+# tracking) runs on time segments in parallel, each segment starting
+# `overlap` seconds early so its tracker is warm at the boundary. track ids
+# are then stitched across boundaries on the overlapping frames and the
+# rules are replayed once over the merged detections, so dwell timers run
+# across segments and every event is reported exactly once.
+#
+# detections are kept columnar: frames[k] is a frame index, its boxes are
+# boxes[offsets[k]:offsets[k + 1]] as (N, 7) filtering-layout rows. segments
+# come back from the pool in order and are stitched, cached and replayed as
+# they arrive, so memory doesn't grow with the length of the footage
+
+def plan_segments(frames, fps, stride=3, segment=300, overlap=10):
+    # (lead-in start, start, end) frame indices; all aligned to the stride
+    # so neighbouring segments sample the same frames in their overlap
+    length = max(stride, int(segment * fps) // stride * stride)
+    lead = int(overlap * fps) // stride * stride
+    return [(max(0, start - lead), start, min(start + length, frames)) for start in range(0, frames, length)]
+
+_model = None
+
+def _load_model(model_path, threads):
+    global _model
+    cv.setNumThreads(threads)
+    from backends import get_model
+    _model = get_model(model_path, threads=threads)
+
+def sample(cap, start, end, stride, seek_above=12):
+    # every stride-th frame in [start, end); short gaps are grabbed (no
+    # decode), long ones are seeked over instead
+    cap.set(cv.CAP_PROP_POS_FRAMES, start)
+    index = start
+    while index < end:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        yield index, frame
+        index += stride
+        if stride > seek_above:
+            cap.set(cv.CAP_PROP_POS_FRAMES, index)
+        else:
+            for _ in range(stride - 1):
+                cap.grab()
+
+def detect_segment(job):
+    from engine import StreamTracker
+    video, (lead, start, end), stride, seek_above = job
+    cap = cv.VideoCapture(video)
+    tracker = StreamTracker(cap.get(cv.CAP_PROP_FPS))
+    frames, boxes, shape = [], [], None
+    for index, frame in sample(cap, lead, end, stride, seek_above):
+        results = _model.predict(frame, verbose=False)
+        boxes.append(tracker.update(results[0], frame))
+        frames.append(index)
+        shape = frame.shape
+    cap.release()
+    return {
+        "video": video,
+        "lead": lead,
+        "start": start,
+        "end": end,
+        "shape": shape,
+        "frames": np.asarray(frames, dtype=np.int64),
+        "offsets": np.cumsum([0] + [len(b) for b in boxes]).astype(np.int64),
+        "boxes": np.concatenate(boxes) if boxes else np.zeros((0, 7), dtype=np.float32),
+    }
+
+def frame_boxes(part, k):
+    return part["boxes"][part["offsets"][k]:part["offsets"][k + 1]]
+
+def link_ids(previous, part, match_iou=0.5, min_votes=2):
+    # {segment id: previous segment id} from same-class IoU matches on the
+    # frames both segments saw (part's lead-in)
+    common = {index: k for k, index in enumerate(previous["frames"])}
+    votes = {}
+    for k, index in enumerate(part["frames"]):
+        if index >= part["start"] or index not in common:
+            continue
+        before = frame_boxes(previous, common[index])
+        for box in frame_boxes(part, k):
+            if box[ID] < 0:
+                continue
+            best, best_iou = None, match_iou
+            for other in before:
+                if other[ID] < 0 or other[CLASS_ID] != box[CLASS_ID]:
+                    continue
+                overlap = iou(box, other)
+                if overlap >= best_iou:
+                    best, best_iou = other[ID], overlap
+            if best is not None:
+                key = (int(box[ID]), int(best))
+                votes[key] = votes.get(key, 0) + 1
+    links, taken = {}, set()
+    for (current, before), n in sorted(votes.items(), key=lambda item: -item[1]):
+        if n >= min_votes and current not in links and before not in taken:
+            links[current] = before
+            taken.add(before)
+    return links
+
+def stitch(parts, match_iou=0.5):
+    # (frame index, boxes) for the whole recording with recording-wide ids,
+    # consuming parts one at a time; each segment's lead-in frames are
+    # dropped in favour of the previous segment's, which saw them as part
+    # of its own range
+    next_id = 0
+    previous, previous_ids = None, {}
+    for part in parts:
+        links = link_ids(previous, part, match_iou) if previous is not None else {}
+        ids = {}
+        for k, index in enumerate(part["frames"]):
+            detections = frame_boxes(part, k).copy()
+            for row in detections:
+                if row[ID] < 0:
+                    continue
+                local = int(row[ID])
+                if local not in ids:
+                    if local in links:
+                        ids[local] = previous_ids[links[local]]
+                    else:
+                        ids[local] = next_id
+                        next_id += 1
+                row[ID] = ids[local]
+            if index >= part["start"]:
+                yield index, detections
+        previous, previous_ids = part, ids
+
+class RecordingClock:
+    # wall-clock time inside a recording (its start plus the video
+    # position), for rules with a clock such as rules.TimeWindowRule
+    def __init__(self, start):
+        self.start = start
+        self.offset = 0.0
+
+    def __call__(self):
+        return self.start + datetime.timedelta(seconds=self.offset)
+
+def recording_start(video, frames, fps):
+    # files are written up to the end of the recording: mtime minus duration
+    return datetime.datetime.fromtimestamp(os.path.getmtime(video)) - datetime.timedelta(seconds=frames / fps)
+
+def replay(rules, detections, fps, shape, camera="DO01", video=None, start=None):
+    # detections: (frame index, boxes) pairs in frame order. with a start
+    # datetime, rules read the recording's time instead of the current time.
+    # rules only look at the frame's shape, so a zero-stride dummy stands in
+    frame = np.broadcast_to(np.zeros(1, dtype=np.uint8), shape)
+    clock = RecordingClock(start) if start is not None else None
+    if clock is not None:
+        for rule in rules:
+            if hasattr(rule, "clock"):
+                rule.clock = clock
+    events = []
+    for index, boxes in detections:
+        current_time = index / fps
+        if clock is not None:
+            clock.offset = current_time
+        for rule in rules:
+            selected, _, fired = rule.evaluate(frame, boxes, current_time)
+            if fired:
+                events.append({
+                    "video": video,
+                    "camera": camera,
+                    "event_type": rule.event_type,
+                    "time": round(current_time, 3),
+                    "recorded_at": clock().isoformat() if clock is not None else None,
+                    "frame": int(index),
+                    "ids": sorted({int(i) for i in selected[:, ID] if i >= 0}),
+                })
+    return events
+
+def recorded(detections, writer):
+    # pass (frame index, boxes) through, appending each to a cache writer
+    for index, boxes in detections:
+        writer.append(index, boxes)
+        yield index, boxes
+
+def analyse(videos, rules, model_path="weights/yolov9m.pt", stride=3, segment=300, overlap=10, workers=None,
+            camera="DO01", seek_above=12, threads=1, cache=None, starts=None):
+    # rules: a rules_from_config list, instantiated fresh for every video.
+    # videos are analysed independently, but all their segments share one
+    # pool, so a single long recording still uses every worker. with a
+    # cache.DetectionCache, stitched detections are stored per video and
+    # later runs (e.g. with different thresholds) skip detection entirely.
+    # starts: {video: datetime} recording start times for time-of-day
+    # rules; missing ones are taken from the file (see recording_start)
+    started = time.perf_counter()
+    starts = starts or {}
+    jobs, info, cached, segments = [], {}, {}, {}
+    for video in videos:
+        cap = cv.VideoCapture(video)
+        fps = cap.get(cv.CAP_PROP_FPS) or 30
+        frames = int(cap.get(cv.CAP_PROP_FRAME_COUNT))
+        cap.release()
+        info[video] = (fps, frames)
+        if cache is not None:
+            cached[video] = cache.open(cache.key(video, model_path, stride))
+        if cached.get(video) is None:
+            planned = plan_segments(frames, fps, stride, segment, overlap)
+            segments[video] = len(planned)
+            jobs.extend((video, seg, stride, seek_above) for seg in planned)
+
+    workers = workers or max(1, min(len(jobs), (os.cpu_count() or 1) // threads))
+    pool = None
+    if jobs:
+        os.environ.setdefault("OMP_NUM_THREADS", str(threads))
+        pool = multiprocessing.get_context("spawn").Pool(workers, initializer=_load_model, initargs=(model_path, threads))
+    timeline = []
+    try:
+        # in job order, so each video's segments arrive together and in sequence
+        results = pool.imap(detect_segment, jobs, chunksize=1) if pool is not None else iter(())
+        for video in videos:
+            fps, frames = info[video]
+            start = starts.get(video) or recording_start(video, frames, fps)
+            writer = None
+            if cached.get(video) is not None:
+                stored = cached[video]
+                detections, shape = zip(stored.frames, stored), tuple(stored.meta["shape"])
+            else:
+                parts = (part for part in itertools.islice(results, segments[video]) if part["shape"] is not None)
+                first = next(parts, None)
+                if first is None:
+                    continue
+                shape = first["shape"]
+                detections = stitch(itertools.chain([first], parts))
+                if cache is not None:
+                    writer = cache.writer(cache.key(video, model_path, stride), video=video, model=model_path,
+                                          stride=stride, fps=fps, shape=shape)
+                    detections = recorded(detections, writer)
+            try:
+                timeline.extend(replay(rules_from_config(rules), detections, fps, shape, camera, video, start))
+            except BaseException:
+                if writer is not None:
+                    writer.close(complete=False)
+                raise
+            if writer is not None:
+                writer.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+    seconds = time.perf_counter() - started
+    footage = sum(frames / fps for fps, frames in info.values())
+    return {
+        "videos": videos,
+        "segments": len(jobs),
+        "workers": workers,
+        "seconds": seconds,
+        "realtime_factor": footage / seconds if seconds else None,
+        "events": timeline,
+    }
+
+def parse_starts(videos, values=(), path=None):
+    # {video: datetime} from a JSON file and/or "ISO" / "VIDEO=ISO" values
+    starts = {}
+    if path:
+        with open(path) as f:
+            starts.update(json.load(f))
+    for value in values:
+        video, _, when = value.rpartition("=")
+        if not video:
+            if len(videos) != 1:
+                raise SystemExit("--start without VIDEO= needs exactly one video")
+            video = videos[0]
+        starts[video] = when
+    return {video: datetime.datetime.fromisoformat(when) for video, when in starts.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description="run the rules over recordings faster than realtime")
+    parser.add_argument("videos", nargs="+")
+    parser.add_argument("--rules", required=True, help="JSON rule config (see rules.rules_from_config)")
+    parser.add_argument("--model", default="weights/yolov9m.pt")
+    parser.add_argument("--camera", default="DO01")
+    parser.add_argument("--stride", type=int, default=3)
+    parser.add_argument("--segment", type=float, default=300, help="seconds per segment")
+    parser.add_argument("--overlap", type=float, default=10, help="seconds of lead-in per segment")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--threads", type=int, default=1, help="inference threads per worker")
+    parser.add_argument("--cache", default=".detections", help="detection cache directory ('' to disable)")
+    parser.add_argument("--start", action="append", default=[],
+                        help="recording start, ISO time (one video) or VIDEO=ISO; default: file mtime minus duration")
+    parser.add_argument("--starts", help="JSON {video: ISO start time}")
+    parser.add_argument("--out", default="timeline.json")
+    args = parser.parse_args()
+
+    with open(args.rules) as f:
+        rules = json.load(f)
+    report = analyse(args.videos, rules, args.model, args.stride, args.segment, args.overlap, args.workers,
+                     args.camera, threads=args.threads, cache=DetectionCache(args.cache) if args.cache else None,
+                     starts=parse_starts(args.videos, args.start, args.starts))
+    for event in report["events"]:
+        print(f"{event['video']}  {time.strftime('%H:%M:%S', time.gmtime(event['time']))}  {event['event_type']}  ids {event['ids']}")
+    print(f"{report['segments']} segments on {report['workers']} workers, {report['realtime_factor']:.1f}x realtime")
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
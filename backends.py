@@ -0,0 +1,282 @@
+import argparse
+import os
+import threading
+import time
+import cv2 as cv
+import numpy as np
+
+from tracks import iou
+
+# a backend is anything with predict(frames, **kwargs) returning one result
+# per frame whose .boxes.data is an (N, 6) [x_min, y_min, x_max, y_max,
+# confidence, class_id] array; ultralytics' YOLO already is one. tracking
+# (engine.StreamTracker) only ever sees those boxes, so any backend can feed it
+
+class Boxes:
+    # the parts of ultralytics' Boxes used by StreamTracker and to_numpy
+    def __init__(self, data):
+        self.data = data
+        self.xyxy = data[:, :4]
+        self.conf = data[:, 4]
+        self.cls = data[:, 5]
+        self.xywh = np.column_stack([(data[:, 0] + data[:, 2]) / 2, (data[:, 1] + data[:, 3]) / 2,
+                                     data[:, 2] - data[:, 0], data[:, 3] - data[:, 1]])
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        # BYTETracker splits detections by confidence with boolean masks
+        return Boxes(self.data[index])
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self
+
+class Result:
+    def __init__(self, data):
+        self.boxes = Boxes(data)
+
+def letterbox(frame, size, color=114):
+    # resize keeping aspect ratio and pad to size x size, as ultralytics does
+    h, w = frame.shape[:2]
+    scale = min(size / h, size / w)
+    nh, nw = round(h * scale), round(w * scale)
+    top, left = (size - nh) // 2, (size - nw) // 2
+    padded = np.full((size, size, 3), color, dtype=np.uint8)
+    padded[top:top + nh, left:left + nw] = cv.resize(frame, (nw, nh), interpolation=cv.INTER_LINEAR)
+    return padded, scale, left, top
+
+class OnnxBackend:
+    # ONNX Runtime on CPU for models exported with export_onnx(). does the
+    # letterbox/NMS that ultralytics would (same iou=0.7 and max_det=300
+    # defaults), so results match its predict()
+    def __init__(self, path, imgsz=640, confidence=0.25, nms_iou=0.7, max_det=300, threads=None,
+                 providers=("CPUExecutionProvider",)):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=list(providers))
+        self.input = self.session.get_inputs()[0]
+        batch, _, height, _ = self.input.shape
+        # a static export fixes the input size; a dynamic one takes imgsz
+        self.imgsz = height if isinstance(height, int) else imgsz
+        self.batched = not isinstance(batch, int)
+        self.confidence = confidence
+        self.nms_iou = nms_iou
+        self.max_det = max_det
+
+    def predict(self, source, conf=None, classes=None, **kwargs):
+        # imgsz/verbose etc. are accepted for YOLO compatibility and ignored
+        frames = source if isinstance(source, list) else [source]
+        conf = self.confidence if conf is None else conf
+        prepared = [letterbox(frame, self.imgsz) for frame in frames]
+        blobs = [cv.dnn.blobFromImage(image, 1 / 255, swapRB=True) for image, *_ in prepared]
+        if self.batched:
+            outputs = self.session.run(None, {self.input.name: np.concatenate(blobs)})[0]
+        else:
+            outputs = np.concatenate([self.session.run(None, {self.input.name: blob})[0] for blob in blobs])
+        results = []
+        for output, frame, (_, scale, left, top) in zip(outputs, frames, prepared):
+            results.append(Result(self.postprocess(output, frame.shape, scale, left, top, conf, classes)))
+        return results
+
+    def postprocess(self, output, shape, scale, left, top, conf, classes):
+        # output: (4 + classes, anchors) of cx, cy, w, h and class scores
+        output = output.T
+        scores = output[:, 4:]
+        class_ids = scores.argmax(1)
+        confidences = scores[np.arange(len(scores)), class_ids]
+        keep = confidences >= conf
+        if classes is not None:
+            keep &= np.isin(class_ids, classes)
+        boxes, confidences, class_ids = output[keep, :4], confidences[keep], class_ids[keep]
+        if not len(boxes):
+            return np.zeros((0, 6), dtype=np.float32)
+        xywh = np.column_stack([boxes[:, 0] - boxes[:, 2] / 2, boxes[:, 1] - boxes[:, 3] / 2, boxes[:, 2], boxes[:, 3]])
+        # class-aware NMS: shift each class to its own region of the plane
+        shifted = xywh.copy()
+        shifted[:, :2] += class_ids[:, None] * (self.imgsz + 1)
+        kept = cv.dnn.NMSBoxes(shifted.tolist(), confidences.tolist(), conf, self.nms_iou)
+        # highest scores first; OpenCV's top_k would cap before suppression
+        kept = np.asarray(kept, dtype=np.int64).reshape(-1)[:self.max_det]
+        xywh, confidences, class_ids = xywh[kept], confidences[kept], class_ids[kept]
+        h, w = shape[:2]
+        xyxy = np.column_stack([xywh[:, 0], xywh[:, 1], xywh[:, 0] + xywh[:, 2], xywh[:, 1] + xywh[:, 3]])
+        xyxy = (xyxy - (left, top, left, top)) / scale
+        xyxy = np.clip(xyxy, 0, (w, h, w, h))
+        return np.column_stack([xyxy, confidences, class_ids]).astype(np.float32)
+
+def load_backend(path, imgsz=640, threads=None, **kwargs):
+    # *.onnx -> OnnxBackend, anything else is loaded by ultralytics.
+    # threads: intra-op threads (ONNX Runtime ignores OMP_NUM_THREADS)
+    if path.endswith(".onnx"):
+        return OnnxBackend(path, imgsz=imgsz, threads=threads, **kwargs)
+    from ultralytics import YOLO
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+    return YOLO(path)
+
+_models = {}
+_models_lock = threading.Lock()
+
+def warm_up(model, imgsz=640):
+    # fold batchnorm into the convs once and push one dummy frame through,
+    # so lazy setup (predictor, graph, allocator) isn't paid on a live frame
+    if not isinstance(model, OnnxBackend):
+        model.fuse()
+    model.predict(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), imgsz=imgsz, verbose=False)
+
+class SharedModel:
+    # a cached model as handed out by get_model(): predict() is serialized,
+    # since ultralytics keeps one predictor (and its state) per model and
+    # callers on other threads (pipelined monitors, archive workers) would
+    # otherwise race on it. everything else goes to the model itself
+    def __init__(self, model):
+        self.model = model
+        self.lock = threading.Lock()
+
+    def predict(self, *args, **kwargs):
+        with self.lock:
+            return self.model.predict(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+def get_model(path, imgsz=640, warm=True, **kwargs):
+    # load_backend(), but each (path, imgsz, options) is loaded and warmed
+    # once per process and shared by every caller (see SharedModel)
+    key = (path, imgsz, tuple(sorted(kwargs.items())))
+    with _models_lock:
+        if key not in _models:
+            start = time.perf_counter()
+            model = load_backend(path, imgsz, **kwargs)
+            if warm:
+                warm_up(model, imgsz)
+            print(f"loaded {path} (imgsz {imgsz}) in {time.perf_counter() - start:.2f}s")
+            _models[key] = SharedModel(model)
+        return _models[key]
+
+def sample_frames(video, n=20):
+    # n frames spread evenly over the video
+    cap = cv.VideoCapture(video)
+    total = int(cap.get(cv.CAP_PROP_FRAME_COUNT))
+    frames = []
+    for index in np.linspace(0, max(total - 1, 0), n).astype(int):
+        cap.set(cv.CAP_PROP_POS_FRAMES, int(index))
+        ret, frame = cap.read()
+        if ret:
+            frames.append(frame)
+    cap.release()
+    return frames
+
+class CalibrationReader:
+    # feeds sample frames to onnxruntime's static quantization
+    def __init__(self, frames, input_name, imgsz):
+        self.blobs = iter([{input_name: cv.dnn.blobFromImage(letterbox(frame, imgsz)[0], 1 / 255, swapRB=True)}
+                           for frame in frames])
+
+    def get_next(self):
+        return next(self.blobs, None)
+
+def export_onnx(weights, imgsz=640, int8=False, calibration=None, dynamic=False):
+    # one-time export: weights/x.pt -> weights/x.onnx (and x.int8.onnx).
+    # INT8 is static (QDQ) when a calibration video is given, else dynamic
+    from ultralytics import YOLO
+    path = YOLO(weights).export(format="onnx", imgsz=imgsz, dynamic=dynamic, simplify=True)
+    if not int8:
+        return path
+    from onnxruntime.quantization import QuantType, quantize_dynamic, quantize_static
+    quantized = os.path.splitext(path)[0] + ".int8.onnx"
+    if calibration is None:
+        quantize_dynamic(path, quantized, weight_type=QuantType.QUInt8)
+    else:
+        import onnxruntime as ort
+        input_name = ort.InferenceSession(path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+        quantize_static(path, quantized, CalibrationReader(sample_frames(calibration), input_name, imgsz),
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    return quantized
+
+def match(reference, candidate, match_iou=0.5):
+    # greedy same-class IoU matching, most confident reference boxes first
+    pairs, used = [], set()
+    for i in np.argsort(-reference[:, 4]):
+        best, best_iou = None, match_iou
+        for j, box in enumerate(candidate):
+            if j in used or box[5] != reference[i, 5]:
+                continue
+            overlap = iou(reference[i], box)
+            if overlap >= best_iou:
+                best, best_iou = j, overlap
+        if best is not None:
+            used.add(best)
+            pairs.append((i, best, best_iou))
+    return pairs
+
+def parity_check(reference, candidate, frames, conf=0.25, match_iou=0.5, imgsz=640):
+    # compares a candidate backend against the reference (PyTorch) on the
+    # same frames: how many reference boxes it finds, how many extra it
+    # reports, how tightly they overlap, and what it costs per frame
+    totals = {"reference": 0, "candidate": 0, "matched": 0}
+    overlaps, confidence_errors = [], []
+    seconds = {"reference": 0.0, "candidate": 0.0}
+    for frame in frames:
+        boxes = {}
+        for name, backend in (("reference", reference), ("candidate", candidate)):
+            start = time.perf_counter()
+            result = backend.predict(frame, imgsz=imgsz, conf=conf, verbose=False)[0]
+            seconds[name] += time.perf_counter() - start
+            boxes[name] = np.asarray(result.boxes.cpu().numpy().data, dtype=np.float32).reshape(-1, 6)
+            totals[name] += len(boxes[name])
+        pairs = match(boxes["reference"], boxes["candidate"], match_iou)
+        totals["matched"] += len(pairs)
+        overlaps.extend(overlap for _, _, overlap in pairs)
+        confidence_errors.extend(abs(boxes["reference"][i, 4] - boxes["candidate"][j, 4]) for i, j, _ in pairs)
+    n = max(len(frames), 1)
+    return {
+        "frames": len(frames),
+        "reference_boxes": totals["reference"],
+        "candidate_boxes": totals["candidate"],
+        "recall": totals["matched"] / totals["reference"] if totals["reference"] else 1.0,
+        "precision": totals["matched"] / totals["candidate"] if totals["candidate"] else 1.0,
+        "mean_iou": float(np.mean(overlaps)) if overlaps else None,
+        "mean_confidence_error": float(np.mean(confidence_errors)) if confidence_errors else None,
+        "reference_ms": seconds["reference"] / n * 1000,
+        "candidate_ms": seconds["candidate"] / n * 1000,
+        "speedup": seconds["reference"] / seconds["candidate"] if seconds["candidate"] else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="export detectors to ONNX Runtime and check them against PyTorch")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export")
+    export.add_argument("weights", nargs="+")
+    export.add_argument("--imgsz", type=int, default=640)
+    export.add_argument("--int8", action="store_true")
+    export.add_argument("--calibration", help="video to calibrate static INT8 quantization on")
+    export.add_argument("--dynamic", action="store_true", help="dynamic batch and input size")
+    parity = commands.add_parser("parity")
+    parity.add_argument("reference")
+    parity.add_argument("candidate")
+    parity.add_argument("video")
+    parity.add_argument("--frames", type=int, default=20)
+    parity.add_argument("--imgsz", type=int, default=640)
+    parity.add_argument("--conf", type=float, default=0.25)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        for weights in args.weights:
+            print(export_onnx(weights, args.imgsz, args.int8, args.calibration, args.dynamic))
+    else:
+        report = parity_check(load_backend(args.reference, args.imgsz), load_backend(args.candidate, args.imgsz),
+                              sample_frames(args.video, args.frames), args.conf, imgsz=args.imgsz)
+        for key, value in report.items():
+            print(f"{key:22s} {value}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import time
+import cv2 as cv
+import numpy as np
+
+from backends import Result
+
+# synthetic scenes: flat background with solid boxes, red = car, blue = person
+BACKGROUND = 90
+COLORS = {2: (0, 0, 255), 0: (255, 0, 0)}
+SIZES = {2: (90, 50), 0: (30, 70)}
+
+# the revsc1-5 scenarios as rule configs, each paired with a synthetic scene
+SCENARIOS = {
+    "dropoff_car": ("moving", [{"type": "dwell", "event_type": "SC01", "classes": [2], "max_time": 2, "confidence": 0.8}]),
+    "person_loitering": ("crowd", [{"type": "dwell", "event_type": "SC02", "classes": [0], "max_time": 2}]),
+    "loading_bay": ("moving", [{"type": "zone", "event_type": "SC03", "classes": [2],
+                                "zone": [(0, 0.35), (0.8, 0.35), (0.8, 1), (0, 1)], "relative": True}]),
+    "nightwatch": ("empty", [{"type": "time_window", "event_type": "SC04", "classes": [0], "confidence": 0.55, "start": 0, "end": 24}]),
+    "carpark": ("crowd", [{"type": "occupancy", "event_type": "SC05", "classes": [2], "confidence": 0.7, "max_count": 8, "duration": 2}]),
+}
+
+def scene_objects(kind, rng, size):
+    w, h = size
+    if kind == "empty":
+        # one person standing still, the rest of the scene never changes
+        return [(0, w * 0.3, h * 0.6, 0.0, 0.0)]
+    count = {"moving": (4, 1), "crowd": (14, 10)}[kind]
+    objects = []
+    for class_id, n in zip((2, 0), count):
+        for i in range(n):
+            speed = 0.0 if i == 0 else rng.uniform(-3, 3)
+            objects.append((class_id, rng.uniform(0, w - 100), rng.uniform(h * 0.2, h - 80), speed, rng.uniform(-1, 1)))
+    return objects
+
+def make_video(path, kind, frames=300, size=(960, 540), fps=30, seed=0):
+    rng = np.random.default_rng(seed)
+    objects = scene_objects(kind, rng, size)
+    w, h = size
+    writer = cv.VideoWriter(path, cv.VideoWriter_fourcc(*"MJPG"), fps, size)
+    for t in range(frames):
+        frame = np.full((h, w, 3), BACKGROUND, dtype=np.uint8)
+        for class_id, x, y, dx, dy in objects:
+            bw, bh = SIZES[class_id]
+            x = int((x + dx * t) % (w - bw))
+            y = int(min(max(y + dy * t, 0), h - bh))
+            cv.rectangle(frame, (x, y), (x + bw, y + bh), COLORS[class_id], -1)
+        writer.write(frame)
+    writer.release()
+    return path
+
+class StubDetector:
+    # deterministic stand-in for YOLO on the synthetic scenes: finds the
+    # coloured boxes by thresholding, so results follow the pixels (crops,
+    # gating and tracking behave as with a real model) at near-zero cost
+    def predict(self, source, **kwargs):
+        frames = source if isinstance(source, list) else [source]
+        return [Result(self.detect(frame)) for frame in frames]
+
+    def detect(self, frame):
+        boxes = []
+        for class_id, color in COLORS.items():
+            lower = np.clip(np.array(color) - 60, 0, 255)
+            upper = np.clip(np.array(color) + 60, 0, 255)
+            mask = cv.inRange(frame, lower, upper)
+            contours, _ = cv.findContours(mask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+            for contour in contours:
+                x, y, bw, bh = cv.boundingRect(contour)
+                if bw * bh >= 100:
+                    boxes.append((x, y, x + bw, y + bh, 0.9, class_id))
+        return np.array(boxes, dtype=np.float32).reshape(-1, 6)
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / (1024 if platform.system() == "Darwin" else 1)
+
+def run_scenario(name, video, detector="stub", mode="plain", stride=3, gate=False, weights="weights/yolov9m.pt"):
+    from monitor import ActivityMonitor
+    from alerts import AlertDispatcher
+    from gating import MotionGate
+    from metrics import StageTimer
+
+    timer = StageTimer()
+    alerts = AlertDispatcher(None, dry_run=True, verbose=False, metrics=timer)
+    model = StubDetector() if detector == "stub" else None
+    monitor = ActivityMonitor(weights, model=model, rules=SCENARIOS[name][1], headless=True, alerts=alerts,
+                              metrics=timer, motion_gate=MotionGate() if gate else None)
+    cap = cv.VideoCapture(video)
+    frames = int(cap.get(cv.CAP_PROP_FRAME_COUNT))
+    source_fps = cap.get(cv.CAP_PROP_FPS)
+    cap.release()
+
+    start = time.perf_counter()
+    monitor.process_video(video, stride=stride, pipelined=mode == "pipelined")
+    elapsed = time.perf_counter() - start
+    alerts.close()
+
+    processed = len(timer.samples.get("rules", ()))
+    return {
+        "scenario": name,
+        "detector": detector,
+        "mode": mode,
+        "stride": stride,
+        "motion_gate": gate,
+        "frames": frames,
+        "processed_frames": processed,
+        "inferences": len(timer.samples.get("inference", ())),
+        "seconds": elapsed,
+        "fps": frames / elapsed,
+        "processed_fps": processed / elapsed,
+        "realtime_factor": frames / source_fps / elapsed if source_fps else None,
+        "stages": timer.percentiles(),
+        "peak_rss_mb": peak_rss_mb(),
+        "alerts": alerts.sent,
+    }
+
+def _worker(conn, args, kwargs):
+    conn.send(run_scenario(*args, **kwargs))
+    conn.close()
+
+def run_isolated(*args, **kwargs):
+    # fresh interpreter per scenario, so peak RSS isn't shared between runs
+    ctx = multiprocessing.get_context("spawn")
+    parent, child = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_worker, args=(child, args, kwargs))
+    process.start()
+    result = parent.recv()
+    process.join()
+    return result
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "opencv": cv.__version__,
+        "numpy": np.__version__,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the scenario pipelines on synthetic video")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--detector", default="stub", choices=["stub", "yolo"])
+    parser.add_argument("--weights", default="weights/yolov9m.pt")
+    parser.add_argument("--mode", nargs="+", default=["plain"], choices=["plain", "pipelined"])
+    parser.add_argument("--stride", type=int, default=3)
+    parser.add_argument("--motion-gate", action="store_true")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--videos", default="bench_videos")
+    parser.add_argument("--out", default="bench_results.json")
+    args = parser.parse_args()
+
+    os.makedirs(args.videos, exist_ok=True)
+    results = []
+    for name in args.scenarios:
+        kind = SCENARIOS[name][0]
+        video = os.path.join(args.videos, f"{kind}_{args.frames}.avi")
+        if not os.path.exists(video):
+            make_video(video, kind, args.frames)
+        for mode in args.mode:
+            result = run_isolated(name, video, args.detector, mode, args.stride, args.motion_gate, args.weights)
+            results.append(result)
+            print(f"{name:18s} {mode:9s} {result['fps']:8.1f} fps  {result['peak_rss_mb']:7.1f} MB  {result['alerts']} alerts")
+
+    with open(args.out, "w") as f:
+        json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "environment": environment(), "results": results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+import numpy as np
+
+from filtering import to_numpy
+
+# per-frame detections and track ids on disk, so rules can be re-tuned and
+# replayed without running the model again. one directory per
+# (video content, model, stride) key holding three fixed-width arrays:
+#   frames.i64   (K,)     frame index of each sampled frame
+#   offsets.i64  (K + 1,) frame k's boxes are boxes[offsets[k]:offsets[k + 1]]
+#   boxes.f32    (M, 7)   filtering-layout rows (x_min .. class_id)
+# written append-only while processing and memory-mapped when read, so
+# memory stays flat however long the video is
+
+CHUNK = 4 << 20
+
+def file_digest(path, chunk=CHUNK):
+    # size plus the first and last chunk: content-based without reading
+    # days of footage end to end
+    digest = hashlib.sha1()
+    size = os.path.getsize(path)
+    digest.update(str(size).encode())
+    with open(path, "rb") as f:
+        digest.update(f.read(chunk))
+        if size > chunk:
+            f.seek(max(chunk, size - chunk))
+            digest.update(f.read(chunk))
+    return digest.hexdigest()
+
+class CacheWriter:
+    def __init__(self, directory, meta):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.meta = dict(meta, complete=False)
+        self.frames = open(os.path.join(directory, "frames.i64"), "wb")
+        self.offsets = open(os.path.join(directory, "offsets.i64"), "wb")
+        self.boxes = open(os.path.join(directory, "boxes.f32"), "wb")
+        self.count = 0
+        self.offsets.write(np.zeros(1, dtype=np.int64).tobytes())
+        self.write_meta()
+
+    def write_meta(self):
+        with open(os.path.join(self.directory, "meta.json"), "w") as f:
+            json.dump(self.meta, f)
+
+    def append(self, frame_index, detections):
+        detections = to_numpy(detections)
+        self.frames.write(np.int64(frame_index).tobytes())
+        self.boxes.write(np.ascontiguousarray(detections, dtype=np.float32).tobytes())
+        self.count += len(detections)
+        self.offsets.write(np.int64(self.count).tobytes())
+
+    def close(self, complete=True):
+        for f in (self.frames, self.offsets, self.boxes):
+            f.close()
+        # only a complete recording is ever replayed
+        self.meta["complete"] = complete
+        self.write_meta()
+
+class CachedDetections:
+    def __init__(self, directory):
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.frames = self.map(directory, "frames.i64", np.int64)
+        self.offsets = self.map(directory, "offsets.i64", np.int64)
+        self.boxes = self.map(directory, "boxes.f32", np.float32).reshape(-1, 7)
+
+    @staticmethod
+    def map(directory, name, dtype):
+        path = os.path.join(directory, name)
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, k):
+        return self.boxes[self.offsets[k]:self.offsets[k + 1]]
+
+    def __iter__(self):
+        # boxes are views into the mapped file, nothing is loaded up front
+        for k in range(len(self.frames)):
+            yield self[k]
+
+class DetectionCache:
+    def __init__(self, directory=".detections"):
+        self.directory = directory
+
+    def key(self, video, model_path, stride):
+        digest = hashlib.sha1()
+        digest.update(file_digest(video).encode())
+        # the model by content too: re-exported or retrained weights miss
+        digest.update(file_digest(model_path).encode() if os.path.exists(model_path) else model_path.encode())
+        digest.update(str(stride).encode())
+        return digest.hexdigest()[:20]
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def open(self, key):
+        # None unless a complete recording exists for this key
+        try:
+            cached = CachedDetections(self.path(key))
+        except FileNotFoundError:
+            return None
+        return cached if cached.meta.get("complete") else None
+
+    def writer(self, key, **meta):
+        return CacheWriter(self.path(key), meta)
+
+def record(video, model_path="weights/yolov9m.pt", stride=3, cache=None, model=None):
+    # one sequential detection + tracking pass into the cache (see
+    # archive.analyse for the parallel version)
+    import cv2 as cv
+    from archive import sample
+    from backends import get_model
+    from engine import StreamTracker
+
+    cache = cache or DetectionCache()
+    key = cache.key(video, model_path, stride)
+    cached = cache.open(key)
+    if cached is not None:
+        return cached
+    model = model or get_model(model_path)
+    cap = cv.VideoCapture(video)
+    fps = cap.get(cv.CAP_PROP_FPS) or 30
+    tracker = StreamTracker(fps)
+    shape = None
+    writer = cache.writer(key, video=video, model=model_path, stride=stride, fps=fps)
+    try:
+        for index, frame in sample(cap, 0, int(cap.get(cv.CAP_PROP_FRAME_COUNT)), stride):
+            writer.append(index, tracker.update(model.predict(frame, verbose=False)[0], frame))
+            shape = frame.shape
+    except BaseException:
+        writer.close(complete=False)
+        raise
+    finally:
+        cap.release()
+    writer.meta["shape"] = shape
+    writer.close()
+    return cache.open(key)
+
+def main():
+    from archive import parse_starts, recording_start, replay
+    from rules import rules_from_config
+
+    parser = argparse.ArgumentParser(description="replay rules over cached detections (recording them first if needed)")
+    parser.add_argument("video")
+    parser.add_argument("--rules", required=True, help="JSON rule config (see rules.rules_from_config)")
+    parser.add_argument("--model", default="weights/yolov9m.pt")
+    parser.add_argument("--stride", type=int, default=3)
+    parser.add_argument("--camera", default="DO01")
+    parser.add_argument("--cache", default=".detections")
+    parser.add_argument("--start", help="recording start, ISO time; default: file mtime minus duration")
+    args = parser.parse_args()
+
+    with open(args.rules) as f:
+        rules = rules_from_config(json.load(f))
+    cached = record(args.video, args.model, args.stride, DetectionCache(args.cache))
+    fps = cached.meta["fps"]
+    recorded_at = parse_starts([args.video], [args.start] if args.start else []).get(args.video)
+    if recorded_at is None:
+        recorded_at = recording_start(args.video, int(cached.frames[-1]) + 1 if len(cached) else 0, fps)
+    t0 = time.perf_counter()
+    events = replay(rules, zip(cached.frames, cached), fps, tuple(cached.meta["shape"]), args.camera, args.video,
+                    recorded_at)
+    elapsed = time.perf_counter() - t0
+    for event in events:
+        print(f"{time.strftime('%H:%M:%S', time.gmtime(event['time']))}  {event['event_type']}  ids {event['ids']}")
+    print(f"replayed {len(cached)} frames in {elapsed:.3f}s ({len(cached) / max(elapsed, 1e-9):.0f} frames/s)")
+
+if __name__ == '__main__':
+    main()
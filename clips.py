@@ -0,0 +1,135 @@
+import queue
+import threading
+from collections import deque
+import cv2 as cv
+import numpy as np
+
+def to_jpeg(data, quality=80):
+    if isinstance(data, bytes):
+        return data
+    return cv.imencode(".jpg", data, [cv.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+def to_image(data):
+    if isinstance(data, bytes):
+        return cv.imdecode(np.frombuffer(data, dtype=np.uint8), cv.IMREAD_COLOR)
+    return data
+
+def pick(frames, count=6):
+    # `count` evenly spaced frames
+    if not frames:
+        return []
+    return [frames[i] for i in np.linspace(0, len(frames) - 1, min(count, len(frames))).round().astype(int)]
+
+def thumbnail_strip(frames, count=6):
+    # `count` evenly spaced frames side by side, as one image
+    if not frames:
+        return None
+    images = [to_image(data) for data in pick(frames, count)]
+    h, w = images[0].shape[:2]
+    return cv.hconcat([image if image.shape[:2] == (h, w) else cv.resize(image, (w, h)) for image in images])
+
+class FrameBuffer:
+    # the last `seconds` of a camera, downscaled by `scale`, within
+    # `max_bytes`. with jpeg=True a background thread stores each frame as
+    # JPEG bytes instead (~10x smaller) so alerts attach them as they are
+    def __init__(self, seconds=5.0, scale=0.25, max_bytes=16 << 20, jpeg=False, quality=80):
+        self.seconds = seconds
+        self.scale = scale
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.frames = deque()
+        self.bytes = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.pending = None
+        if jpeg:
+            self.pending = queue.Queue(maxsize=8)
+            self.encoder = threading.Thread(target=self.encode, daemon=True)
+            self.encoder.start()
+
+    def push(self, frame, current_time):
+        small = cv.resize(frame, (0, 0), fx=self.scale, fy=self.scale, interpolation=cv.INTER_AREA)
+        if self.pending is None:
+            self.append(current_time, small)
+            return
+        try:
+            self.pending.put_nowait((current_time, small))
+        except queue.Full:
+            # the encoder is behind; a gap in the clip beats stalling detection
+            self.dropped += 1
+
+    def encode(self):
+        while True:
+            current_time, small = self.pending.get()
+            try:
+                self.append(current_time, to_jpeg(small, self.quality))
+            finally:
+                self.pending.task_done()
+
+    def append(self, current_time, data):
+        with self.lock:
+            self.frames.append((current_time, data))
+            self.bytes += len(data) if isinstance(data, bytes) else data.nbytes
+            while self.frames and (self.bytes > self.max_bytes or current_time - self.frames[0][0] > self.seconds):
+                _, old = self.frames.popleft()
+                self.bytes -= len(old) if isinstance(old, bytes) else old.nbytes
+
+    def window(self, start, end):
+        # [(time, frame)] between start and end that are already stored;
+        # frames still waiting for the encoder are left out rather than
+        # waited for (the recorder's after-window usually covers them)
+        with self.lock:
+            return [(t, data) for t, data in self.frames if start <= t <= end]
+
+    def drain(self):
+        # wait for the encoder; only where blocking is fine (end of video)
+        if self.pending is not None:
+            self.pending.join()
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.bytes = 0
+
+class ClipRecorder:
+    # holds a fired alert until `after` seconds of frames have followed it,
+    # then attaches the buffered frames from `before` seconds ahead of it:
+    #   mode="clip"   payload["clip"]: frames, payload["clip_times"]: offsets (s)
+    #   mode="strip"  payload["strip"]: strip_count frames for one thumbnail strip
+    # the strip is stitched and everything JPEG/base64 encoded by the
+    # AlertDispatcher's worker, not here on the detection thread
+    def __init__(self, buffer=None, before=3.0, after=2.0, mode="strip", strip_count=6):
+        self.buffer = buffer or FrameBuffer(seconds=before + after)
+        self.before = before
+        self.after = after
+        self.mode = mode
+        self.strip_count = strip_count
+        self.pending = []
+
+    def reset(self):
+        self.buffer.clear()
+        self.pending = []
+
+    def add(self, payload, frame, current_time):
+        self.pending.append((current_time, payload, frame))
+
+    def attach(self, event_time, payload):
+        window = self.buffer.window(event_time - self.before, event_time + self.after)
+        payload = dict(payload)
+        if self.mode == "clip":
+            payload["clip"] = [data for _, data in window]
+            payload["clip_times"] = [round(t - event_time, 3) for t, _ in window]
+        else:
+            payload["strip"] = pick([data for _, data in window], self.strip_count)
+        return payload
+
+    def ready(self, current_time=None):
+        # (payload, frame) for every alert whose after-window has passed;
+        # all of them when current_time is None (end of video)
+        if current_time is None:
+            self.buffer.drain()
+        done, waiting = [], []
+        for item in self.pending:
+            (done if current_time is None or current_time - item[0] >= self.after else waiting).append(item)
+        self.pending = waiting
+        return [(self.attach(event_time, payload), frame) for event_time, payload, frame in done]
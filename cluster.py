@@ -0,0 +1,452 @@
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import time
+from multiprocessing import shared_memory
+import cv2 as cv
+import numpy as np
+
+# ring header slots
+WRITTEN, READ, CLOSED, DROPPED, POSITION, FPS = range(6)
+HEADER = 8
+
+class FrameRing:
+    # single-producer, single-consumer ring of decoded frames in shared
+    # memory. the decoder reads straight into a free slot and publishes it by
+    # bumping WRITTEN; the worker uses the slot in place and frees it on its
+    # next get(), so frames cross the process boundary without being pickled
+    def __init__(self, shape, slots=8, name=None, create=False, fps=30.0):
+        self.shape = tuple(shape)
+        self.slots = slots
+        size = (HEADER + slots) * 8 + slots * int(np.prod(self.shape))
+        # spawned children share the supervisor's resource tracker, so the
+        # segment is only unlinked by the creator (or when the supervisor dies)
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        self.name = self.shm.name
+        self.header = np.ndarray((HEADER,), np.int64, self.shm.buf)
+        self.indexes = np.ndarray((slots,), np.int64, self.shm.buf, offset=HEADER * 8)
+        self.frames = np.ndarray((slots,) + self.shape, np.uint8, self.shm.buf, offset=(HEADER + slots) * 8)
+        self.held = False
+        if create:
+            self.header[:] = 0
+            self.header[FPS] = round(fps * 1000)
+
+    def spec(self):
+        # what another process needs to attach
+        return {"shape": self.shape, "slots": self.slots, "name": self.name}
+
+    @property
+    def fps(self):
+        return self.header[FPS] / 1000
+
+    @property
+    def closed(self):
+        return bool(self.header[CLOSED])
+
+    def reserve(self, block=True, stop=None):
+        # the next free slot, or None when full and not blocking (or stopping)
+        while self.header[WRITTEN] - self.header[READ] >= self.slots:
+            if not block or (stop is not None and stop.is_set()):
+                return None
+            time.sleep(0.001)
+        return self.frames[self.header[WRITTEN] % self.slots]
+
+    def publish(self, index):
+        # only called once the reserved slot is fully written
+        self.indexes[self.header[WRITTEN] % self.slots] = index
+        self.header[WRITTEN] += 1
+        self.header[POSITION] = index
+
+    def pending(self):
+        # published frames not yet handed out by get()
+        return int(self.header[WRITTEN] - self.header[READ]) - self.held
+
+    def get(self):
+        # (frame, frame index) or None; the frame is a view into the ring
+        # and stays valid until the next get()
+        if self.held:
+            self.header[READ] += 1
+            self.held = False
+        if self.header[READ] == self.header[WRITTEN]:
+            return None
+        slot = self.header[READ] % self.slots
+        self.held = True
+        return self.frames[slot], int(self.indexes[slot])
+
+    def close(self, unlink=False):
+        self.header = self.indexes = self.frames = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # a frame view is still alive somewhere; the mapping goes with the process
+            pass
+        if unlink:
+            self.shm.unlink()
+
+class RingCapture:
+    # the cv.VideoCapture calls engine.Stream makes, served from a FrameRing.
+    # read() never waits: an empty ring is "no frame yet" unless `ended`, so
+    # a slow or restarting decoder doesn't hold up the worker's other cameras
+    def __init__(self, ring, stop=None):
+        self.ring = ring
+        self.stop = stop
+        self.position = 0
+        self.frames = 0
+
+    def read(self):
+        item = self.ring.get()
+        if item is None:
+            return False, None
+        frame, self.position = item
+        self.frames += 1
+        return True, frame
+
+    @property
+    def ended(self):
+        # the decoder publishes its last frame before closing the ring
+        if self.stop is not None and self.stop.is_set():
+            return True
+        return self.ring.closed and self.ring.pending() <= 0
+
+    def grab(self):
+        return self.read()[0]
+
+    def get(self, prop):
+        if prop == cv.CAP_PROP_POS_FRAMES:
+            return self.position
+        if prop == cv.CAP_PROP_FPS:
+            return self.ring.fps
+        return 0
+
+    def isOpened(self):
+        return self.ring.header is not None
+
+    def release(self):
+        self.ring.close()
+
+def decode(source, ring, stride=3, block=True, stop=None):
+    # one process per camera; resumes from the ring's last published frame
+    # when restarted after a crash
+    ring = FrameRing(**ring)
+    cap = cv.VideoCapture(source)
+    if ring.header[POSITION]:
+        cap.set(cv.CAP_PROP_POS_FRAMES, int(ring.header[POSITION]))
+    finished = False
+    while not (stop is not None and stop.is_set()):
+        sampled = (int(cap.get(cv.CAP_PROP_POS_FRAMES)) + 1) % stride == 0
+        slot = ring.reserve(block, stop) if sampled else None
+        if slot is None:
+            # skipped by stride, or dropped because the worker is behind
+            if sampled:
+                ring.header[DROPPED] += 1
+            if not cap.grab():
+                finished = True
+                break
+            continue
+        ret, frame = cap.read(slot)
+        if not ret:
+            finished = True
+            break
+        if not np.shares_memory(frame, slot):
+            # a source whose size changed mid-stream: fit it to the ring
+            slot[:] = cv.resize(frame, (ring.shape[1], ring.shape[0]))
+        ring.publish(int(cap.get(cv.CAP_PROP_POS_FRAMES)))
+    if finished:
+        ring.header[CLOSED] = 1
+    cap.release()
+    ring.close()
+
+def work(worker_id, cameras, model_path, states, messages, stop, api_url=None, report_every=5.0, threads=1,
+         poll=0.002):
+    # one process per shard: one model, one MultiStreamEngine batching all of
+    # its cameras, one ActivityMonitor per camera reading from its ring
+    from alerts import AlertDispatcher
+    from backends import get_model
+    from engine import MultiStreamEngine
+    from metrics import Metrics
+    from monitor import ActivityMonitor
+
+    cv.setNumThreads(1)
+    engine = MultiStreamEngine(model_path, model=get_model(model_path, threads=threads), headless=True)
+    alerts = AlertDispatcher(api_url, spool_path=f"alerts.{worker_id}.spool", dry_run=api_url is None)
+    monitors, captures = {}, {}
+    for camera in cameras:
+        name = camera["name"]
+        captures[name] = RingCapture(FrameRing(**camera["ring"]), stop)
+        monitors[name] = ActivityMonitor(model=engine.model, camera_number=name, headless=True, alerts=alerts,
+                                         rules=camera["rules"], metrics=Metrics(name))
+        monitors[name].attach(engine, name, captures[name], api_url=api_url, stride=1)
+        # dwell timers and alert flags from this camera's previous worker
+        for rule, state in zip(monitors[name].rules, states.get(name, ())):
+            rule.restore(state)
+
+    def report():
+        now = time.perf_counter()
+        waited = last["idle"]
+        messages.put((worker_id, {
+            "pid": os.getpid(),
+            "busy": max(0.0, 1 - (waited - last["waited"]) / max(now - last["time"], 1e-6)),
+            "cameras": {name: {
+                "frames": monitor.metrics.counters[("frames_processed",)],
+                "fps": monitor.metrics.processed_fps(),
+                "video_time": monitor.metrics.gauges.get("video_time"),
+                "first_frame": monitor.first_frame,
+            } for name, monitor in monitors.items()},
+            "states": {name: [rule.state() for rule in monitor.rules] for name, monitor in monitors.items()},
+        }))
+        last.update(time=now, waited=waited)
+
+    last = {"time": time.perf_counter(), "waited": 0.0, "idle": 0.0}
+    try:
+        while not stop.is_set():
+            frames = sum(capture.frames for capture in captures.values())
+            if not engine.step():
+                break
+            if sum(capture.frames for capture in captures.values()) == frames:
+                # every ring was empty
+                time.sleep(poll)
+                last["idle"] += poll
+            if time.perf_counter() - last["time"] >= report_every:
+                report()
+    finally:
+        report()
+        engine.close()
+        for monitor in monitors.values():
+            monitor.flush_alerts(api_url)
+        alerts.close()
+
+class Supervisor:
+    # shards cameras over worker processes: a decoder process per camera
+    # fills a shared-memory FrameRing, each worker runs detection, tracking
+    # and rules for its cameras. crashed decoders resume from their last
+    # frame and crashed workers restart with their cameras' last reported
+    # rule state. report() shows per-worker load, rebalance() acts on it
+    def __init__(self, cameras, model_path="weights/yolov9m.pt", workers=None, slots=8, api_url=None,
+                 report_every=5.0, block=True, threads=1, max_restarts=5, min_gain=0.1):
+        self.ctx = multiprocessing.get_context("spawn")
+        # cameras: [{"name": "DO01", "source": "...", "stride": 3, "rules": [...]}, ...]
+        self.cameras = {camera["name"]: dict(camera) for camera in cameras}
+        # threads: torch/onnx threads per worker; workers * threads ~= cores
+        self.threads = threads
+        self.n_workers = workers or max(1, min(len(self.cameras), (os.cpu_count() or 1) // threads))
+        self.model_path = model_path
+        self.slots = slots
+        self.api_url = api_url
+        self.report_every = report_every
+        self.block = block
+        self.max_restarts = max_restarts
+        # rebalance only for at least this cut in the busiest worker's load,
+        # not for measurement noise
+        self.min_gain = min_gain
+        self.stop = self.ctx.Event()
+        self.messages = self.ctx.Queue()
+        self.rings = {}
+        self.decoders = {}
+        self.workers = {}
+        self.worker_stops = {}
+        self.assignment = {}
+        self.states = {}
+        self.loads = {}
+        self.restarts = dict.fromkeys(range(self.n_workers), 0)
+
+    def probe(self, source):
+        cap = cv.VideoCapture(source)
+        ret, frame = cap.read()
+        fps = cap.get(cv.CAP_PROP_FPS) or 30
+        cap.release()
+        if not ret:
+            raise ValueError(f"cannot read a frame from {source}")
+        return frame.shape, fps
+
+    def plan(self, costs):
+        # longest-processing-time first: heaviest camera to the least loaded worker
+        loads = dict.fromkeys(range(self.n_workers), 0.0)
+        assignment = {worker_id: [] for worker_id in loads}
+        for name in sorted(costs, key=costs.get, reverse=True):
+            worker_id = min(loads, key=loads.get)
+            assignment[worker_id].append(name)
+            loads[worker_id] += costs[name]
+        return assignment
+
+    def relabel(self, assignment):
+        # plan() numbers its groups afresh: give each group the worker that
+        # already runs most of its cameras, so only real moves restart workers
+        overlaps = sorted(((len(set(names) & set(self.assignment[old])), new, old)
+                           for new, names in assignment.items() for old in self.assignment), reverse=True)
+        relabelled, used = {}, set()
+        for _, new, old in overlaps:
+            if new not in relabelled and old not in used:
+                relabelled[new] = old
+                used.add(old)
+        return {relabelled[new]: names for new, names in assignment.items()}
+
+    def start(self):
+        # child processes read this when they import torch / onnxruntime
+        os.environ.setdefault("OMP_NUM_THREADS", str(self.threads))
+        costs = {}
+        for name, camera in self.cameras.items():
+            shape, fps = self.probe(camera["source"])
+            self.rings[name] = FrameRing(shape, self.slots, create=True, fps=fps)
+            camera["ring"] = self.rings[name].spec()
+            costs[name] = fps / camera.get("stride", 3)
+            self.start_decoder(name)
+        self.assignment = self.plan(costs)
+        for worker_id in self.assignment:
+            self.start_worker(worker_id)
+
+    def start_decoder(self, name):
+        camera = self.cameras[name]
+        self.decoders[name] = self.ctx.Process(
+            target=decode, args=(camera["source"], camera["ring"], camera.get("stride", 3), self.block, self.stop),
+            name=f"decode-{name}", daemon=True)
+        self.decoders[name].start()
+
+    def start_worker(self, worker_id):
+        names = self.assignment[worker_id]
+        if not names:
+            return
+        cameras = [{k: self.cameras[name][k] for k in ("name", "ring", "rules")} for name in names]
+        states = {name: self.states[name] for name in names if name in self.states}
+        # the new process reports from scratch; don't mix in the old one's load
+        self.loads.pop(worker_id, None)
+        self.worker_stops[worker_id] = self.ctx.Event()
+        self.workers[worker_id] = self.ctx.Process(
+            target=work, args=(worker_id, cameras, self.model_path, states, self.messages,
+                               self.worker_stops[worker_id], self.api_url, self.report_every, self.threads),
+            name=f"worker-{worker_id}", daemon=True)
+        self.workers[worker_id].start()
+
+    def drain(self, timeout=0.0):
+        try:
+            while True:
+                worker_id, report = self.messages.get(timeout=timeout)
+                timeout = 0.0
+                self.states.update(report.pop("states"))
+                self.loads[worker_id] = report
+        except queue.Empty:
+            pass
+
+    def poll(self, timeout=1.0):
+        self.drain(timeout)
+        for name, process in list(self.decoders.items()):
+            if process.exitcode is None:
+                continue
+            del self.decoders[name]
+            if process.exitcode != 0 and not self.stop.is_set():
+                print(f"decoder {name} exited with {process.exitcode}, restarting")
+                self.start_decoder(name)
+        for worker_id, process in list(self.workers.items()):
+            if process.exitcode is None:
+                continue
+            del self.workers[worker_id]
+            if process.exitcode != 0 and not self.stop.is_set():
+                self.drain()
+                self.restarts[worker_id] += 1
+                if self.restarts[worker_id] > self.max_restarts:
+                    print(f"worker {worker_id} keeps crashing, giving up on {self.assignment[worker_id]}")
+                    continue
+                print(f"worker {worker_id} exited with {process.exitcode}, restarting {self.assignment[worker_id]}")
+                self.start_worker(worker_id)
+
+    def report(self):
+        # per worker: share of wall time spent working (not waiting for
+        # frames), processed fps, and each camera's fps and ring drops
+        lines = []
+        for worker_id, names in self.assignment.items():
+            load = self.loads.get(worker_id, {})
+            cameras = load.get("cameras", {})
+            fps = sum(camera["fps"] for camera in cameras.values())
+            lines.append(f"worker {worker_id}  pid {load.get('pid', '-')}  busy {load.get('busy', 0):4.0%}  "
+                         f"{fps:6.1f} fps  restarts {self.restarts[worker_id]}")
+            for name in names:
+                camera = cameras.get(name, {})
+                lines.append(f"  {name:10s} {camera.get('fps', 0):6.1f} fps  {camera.get('frames', 0):8d} frames  "
+                             f"{int(self.rings[name].header[DROPPED])} dropped  "
+                             f"first frame {camera.get('first_frame') or 0:.1f}s")
+        return "\n".join(lines)
+
+    def rebalance(self):
+        # re-plan from measured cost (each camera's share of its worker's
+        # busy time) and move cameras, with their rule state, between workers
+        costs = {}
+        for worker_id, load in self.loads.items():
+            cameras = {name: c for name, c in load["cameras"].items() if name in self.assignment[worker_id]}
+            total = sum(camera["fps"] for camera in cameras.values())
+            if not total or not sum(camera["frames"] for camera in cameras.values()):
+                # nothing processed yet (still loading the model): no cost to go on
+                continue
+            costs.update({name: load["busy"] * camera["fps"] / total for name, camera in cameras.items()})
+        if set(costs) != set(self.cameras):
+            return False
+        assignment = self.relabel(self.plan(costs))
+        changed = [w for w in assignment if sorted(assignment[w]) != sorted(self.assignment[w])]
+        if not changed:
+            return False
+        busiest = max(sum(costs[name] for name in names) for names in self.assignment.values())
+        planned = max(sum(costs[name] for name in names) for names in assignment.values())
+        if planned > busiest * (1 - self.min_gain):
+            return False
+        # a ring has one reader: stop every affected worker before starting any
+        for worker_id in changed:
+            if worker_id in self.workers:
+                self.worker_stops[worker_id].set()
+        for worker_id in changed:
+            if worker_id in self.workers:
+                self.workers.pop(worker_id).join()
+        self.drain()
+        self.assignment = assignment
+        for worker_id in changed:
+            self.start_worker(worker_id)
+        return True
+
+    def run(self, rebalance_every=None):
+        self.start()
+        last_report = last_rebalance = time.monotonic()
+        try:
+            while self.workers:
+                self.poll()
+                now = time.monotonic()
+                if now - last_report >= self.report_every:
+                    print(self.report())
+                    last_report = now
+                if rebalance_every and now - last_rebalance >= rebalance_every:
+                    self.rebalance()
+                    last_rebalance = now
+        finally:
+            self.close()
+
+    def close(self):
+        self.stop.set()
+        for stop in self.worker_stops.values():
+            stop.set()
+        for process in list(self.workers.values()) + list(self.decoders.values()):
+            process.join(timeout=5)
+            if process.exitcode is None:
+                process.terminate()
+        self.drain()
+        for ring in self.rings.values():
+            ring.close(unlink=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="run many cameras across worker processes")
+    parser.add_argument("cameras", help='JSON list of {"name", "source", "stride", "rules"}')
+    parser.add_argument("--model", default="weights/yolov9m.pt")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--threads", type=int, default=1, help="inference threads per worker")
+    parser.add_argument("--slots", type=int, default=8)
+    parser.add_argument("--api-url")
+    parser.add_argument("--rebalance-every", type=float)
+    parser.add_argument("--rebalance-gain", type=float, default=0.1,
+                        help="minimum cut in the busiest worker's load for a rebalance")
+    args = parser.parse_args()
+
+    with open(args.cameras) as f:
+        cameras = json.load(f)
+    supervisor = Supervisor(cameras, args.model, args.workers, args.slots, args.api_url, threads=args.threads,
+                            min_gain=args.rebalance_gain)
+    supervisor.run(args.rebalance_every)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+import inspect
+import time
+import cv2 as cv
+import numpy as np
+
+from backends import get_model
+from zones import crop, offset_boxes
+from metrics import timed
+
+EMPTY = np.zeros((0, 7), dtype=np.float32)
+
+# ultralytics (and with it torch) is imported on first use, not at import
+# time, so tools that never track or infer start instantly
+
+def tracker_config(name="bytetrack.yaml"):
+    from ultralytics.utils import IterableSimpleNamespace
+    from ultralytics.utils.checks import check_yaml
+    try:
+        from ultralytics.utils import YAML
+        load = YAML.load
+    except ImportError:
+        # older releases only have the function
+        from ultralytics.utils import yaml_load as load
+    return IterableSimpleNamespace(**load(check_yaml(name)))
+
+class StreamTracker:
+    # one tracker per camera, so a shared model can serve many streams
+    # (model.track(persist=True) keeps a single tracker on the model itself)
+    def __init__(self, frame_rate=30, config="bytetrack.yaml"):
+        from ultralytics.trackers.byte_tracker import BYTETracker
+        # newer releases dropped frame_rate and count track_buffer in frames
+        kwargs = {"frame_rate": int(frame_rate or 30)} if "frame_rate" in inspect.signature(BYTETracker).parameters else {}
+        self.tracker = BYTETracker(args=tracker_config(config), **kwargs)
+
+    def update(self, result, frame):
+        boxes = result.boxes.cpu().numpy()
+        if len(boxes) == 0:
+            self.tracker.update(boxes, frame)
+            return EMPTY
+        tracks = self.tracker.update(boxes, frame)
+        if len(tracks) == 0:
+            return EMPTY
+        # x_min, y_min, x_max, y_max, id, confidence, class_id
+        return tracks[:, :7].astype(np.float32)
+
+class Stream:
+    def __init__(self, name, source, handler, stride=3, gate=None, crop=None, metrics=None, governor=None):
+        self.name = name
+        # source: anything cv.VideoCapture opens, or an already open capture
+        # (e.g. cluster.RingCapture)
+        self.cap = source if hasattr(source, "read") else cv.VideoCapture(source)
+        self.fps = self.cap.get(cv.CAP_PROP_FPS) or 30
+        self.handler = handler
+        self.stride = stride
+        self.tracker = StreamTracker(self.fps)
+        self.gate = gate
+        # crop(frame) -> (x_min, y_min, x_max, y_max) or None for full frame
+        self.crop = crop
+        self.metrics = metrics
+        # optional schedule.Governor deciding which frames to process
+        self.governor = governor
+        self.last_detections = None
+        self.current_frame = 0
+        self.done = False
+
+    def next_frame(self):
+        if self.governor is not None:
+            return self.next_governed()
+        # grab (no decode) the frames we skip, decode only the sampled one
+        with timed(self.metrics, "decode"):
+            for _ in range(self.stride - 1):
+                if not self.cap.grab():
+                    self.done = self.ended
+                    return None
+            ret, frame = self.cap.read()
+        if not ret:
+            self.done = self.ended
+            return None
+        if self.metrics is not None:
+            self.metrics.count("frames_read", self.stride)
+            self.metrics.count("frames_skipped", self.stride - 1)
+        self.current_frame = int(self.cap.get(cv.CAP_PROP_POS_FRAMES))
+        return frame
+
+    def next_governed(self):
+        # at most one stride of frames per step, so a camera that is off or
+        # on keep-alive never holds up the others; None if nothing was due
+        for _ in range(max(self.governor.window.stride, 1)):
+            current_frame = int(self.cap.get(cv.CAP_PROP_POS_FRAMES)) + 1
+            sampled = self.governor.sample(current_frame, current_frame / self.fps)
+            with timed(self.metrics, "decode"):
+                ret, frame = self.cap.read() if sampled else (self.cap.grab(), None)
+            if not ret:
+                self.done = self.ended
+                return None
+            if self.metrics is not None:
+                self.metrics.count("frames_read")
+                if not sampled:
+                    self.metrics.count("frames_skipped")
+            if sampled:
+                self.current_frame = current_frame
+                return frame
+        return None
+
+    @property
+    def ended(self):
+        # a failed read ends a file; a live capture (cluster.RingCapture) may
+        # only have no frame yet
+        return getattr(self.cap, "ended", True)
+
+    def close(self):
+        self.cap.release()
+
+class MultiStreamEngine:
+    def __init__(self, model_path, batch_size=16, imgsz=640, model=None, headless=False):
+        self.model = model if model is not None else get_model(model_path, imgsz)
+        self.batch_size = batch_size
+        self.imgsz = imgsz
+        self.headless = headless
+        self.streams = {}
+
+    def add_stream(self, name, source, handler, stride=3, gate=None, crop=None, metrics=None, governor=None):
+        # handler(frame, detections, current_time) is called once per sampled frame
+        self.streams[name] = Stream(name, source, handler, stride, gate, crop, metrics, governor)
+        return self.streams[name]
+
+    def infer(self, frames, imgsz=None):
+        results = []
+        for i in range(0, len(frames), self.batch_size):
+            results.extend(self.model.predict(frames[i:i + self.batch_size], imgsz=imgsz or self.imgsz, verbose=False))
+        return results
+
+    def infer_grouped(self, batch, inputs):
+        # a schedule window may set its own input size; one pass per size
+        sizes = [stream.governor.imgsz if stream.governor is not None else None for stream, _, _ in batch]
+        results = [None] * len(inputs)
+        for size in set(sizes):
+            indexes = [i for i, s in enumerate(sizes) if s == size]
+            for i, result in zip(indexes, self.infer([inputs[i] for i in indexes], size)):
+                results[i] = result
+        return results
+
+    def share_idle(self):
+        # cameras outside their active windows leave CPU free: spread it over
+        # the active ones by shortening their stride (see schedule.Window.min_stride)
+        governors = [stream.governor for stream in self.streams.values() if stream.governor is not None and not stream.done]
+        for governor in governors:
+            governor.update()
+        active = sum(governor.active for governor in governors)
+        for governor in governors:
+            governor.share = (active / len(governors)) if active else 1.0
+
+    def step(self):
+        self.share_idle()
+        batch, gated = [], []
+        for stream in self.streams.values():
+            if stream.done:
+                continue
+            frame = stream.next_frame()
+            if frame is None:
+                continue
+            current_time = stream.current_frame / stream.fps
+            if stream.gate is not None and stream.last_detections is not None and not stream.gate.check(frame, current_time):
+                gated.append((stream, frame))
+                if stream.metrics is not None:
+                    stream.metrics.count("frames_gated")
+            else:
+                rect = stream.crop(frame) if stream.crop else None
+                batch.append((stream, frame, rect))
+        if not batch and not gated:
+            # idle cameras may still be running through frames
+            return any(not stream.done for stream in self.streams.values())
+
+        inputs = [frame if rect is None else crop(frame, rect) for _, frame, rect in batch]
+        start = time.perf_counter()
+        results = self.infer_grouped(batch, inputs) if batch else []
+        # one forward pass serves the whole batch; charge each stream its share
+        share = (time.perf_counter() - start) / max(len(batch), 1)
+        for stream, _, _ in batch:
+            if stream.metrics is not None:
+                stream.metrics.record("inference", share)
+        for (stream, _, rect), image, result in zip(batch, inputs, results):
+            detections = stream.tracker.update(result, image)
+            stream.last_detections = detections if rect is None else offset_boxes(detections, rect[0], rect[1])
+        for stream, frame in [(s, f) for s, f, _ in batch] + gated:
+            if stream.handler(frame, stream.last_detections, stream.current_frame / stream.fps) is False:
+                stream.done = True
+        return True
+
+    def run(self):
+        try:
+            while self.step():
+                pass
+        finally:
+            self.close()
+
+    def close(self):
+        for stream in self.streams.values():
+            stream.close()
+        if not self.headless:
+            cv.destroyAllWindows()
+
+if __name__ == '__main__':
+    from monitor import ActivityMonitor
+    from alerts import AlertDispatcher
+    from metrics import JsonlSink, MetricsServer, Registry
+
+    engine = MultiStreamEngine("weights/yolov9m.pt")
+    alerts = AlertDispatcher("https://example.com/api_endpoint", dry_run=True)
+    # per-camera metrics: snapshots to metrics.jsonl, live at localhost:9108/metrics
+    registry = Registry()
+    sink = JsonlSink(registry)
+    server = MetricsServer(registry)
+    cameras = [
+        ("DO01", "cctv/dropoff_loitering.mp4", 2, "SC02", None),
+        ("CP01", "cctv/carpark.mp4", 2, "SC05", (0, 0, 600, 550)),
+    ]
+    monitors = []
+    for name, video, object_class, event_type, roi in cameras:
+        monitor = ActivityMonitor(model=engine.model, max_time=10, confidence_thresh=0.7, roi=roi, camera_number=name, headless=engine.headless, alerts=alerts,
+                                  metrics=registry.camera(name))
+        monitor.attach(engine, name, video, object_class=object_class, event_type=event_type, api_url="https://example.com/api_endpoint")
+        monitors.append(monitor)
+    engine.run()
+    for monitor in monitors:
+        monitor.flush_alerts()
+    sink.close()
+    server.close()
@@ -0,0 +1,31 @@
+import numpy as np
+
+# column layout used throughout: x_min, y_min, x_max, y_max, id, confidence, class_id
+X_MIN, Y_MIN, X_MAX, Y_MAX, ID, CONFIDENCE, CLASS_ID = range(7)
+
+def to_numpy(data):
+    # boxes.data from ultralytics (6 columns when untracked, 7 when tracked)
+    # moved to a float32 (N, 7) array once per frame; missing ids are -1
+    if hasattr(data, "cpu"):
+        data = data.cpu().numpy()
+    data = np.asarray(data, dtype=np.float32)
+    if data.size == 0:
+        return np.zeros((0, 7), dtype=np.float32)
+    if data.shape[1] == 6:
+        data = np.insert(data, ID, -1, axis=1)
+    return data[:, :7]
+
+def anchors(detections):
+    # bottom-centre of each box, where the object touches the ground
+    return (detections[:, X_MIN] + detections[:, X_MAX]) / 2, detections[:, Y_MAX]
+
+def filter_detections(detections, confidence=0.0, classes=None, zone=None, tracked=False):
+    detections = to_numpy(detections)
+    keep = detections[:, CONFIDENCE] >= confidence
+    if classes is not None:
+        keep &= np.isin(detections[:, CLASS_ID].astype(np.int32), classes)
+    if tracked:
+        keep &= detections[:, ID] >= 0
+    if zone is not None:
+        keep &= zone.contains(*anchors(detections))
+    return detections[keep]
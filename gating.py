@@ -0,0 +1,43 @@
+import cv2 as cv
+
+class MotionGate:
+    # cheap frame-difference check on a downscaled, grayscale copy of the ROI.
+    # check() returns True when the detector should run on this frame.
+    def __init__(self, roi=None, scale=0.25, pixel_thresh=25, min_area=0.002, keepalive=10.0, learning_rate=0.05):
+        self.roi = roi
+        self.scale = scale
+        self.pixel_thresh = pixel_thresh
+        self.min_area = min_area
+        self.keepalive = keepalive
+        self.learning_rate = learning_rate
+        self.background = None
+        self.last_run = None
+        self.skipped = 0
+
+    def prepare(self, frame):
+        if self.roi:
+            x_min, y_min, x_max, y_max = (int(v) for v in self.roi)
+            frame = frame[max(y_min, 0):y_max, max(x_min, 0):x_max]
+        small = cv.resize(frame, (0, 0), fx=self.scale, fy=self.scale, interpolation=cv.INTER_AREA)
+        gray = cv.cvtColor(small, cv.COLOR_BGR2GRAY)
+        return cv.GaussianBlur(gray, (5, 5), 0)
+
+    def motion(self, gray):
+        diff = cv.absdiff(gray, cv.convertScaleAbs(self.background))
+        _, mask = cv.threshold(diff, self.pixel_thresh, 255, cv.THRESH_BINARY)
+        return cv.countNonZero(mask) >= self.min_area * mask.size
+
+    def check(self, frame, current_time):
+        gray = self.prepare(frame)
+        if self.background is None:
+            self.background = gray.astype("float32")
+            self.last_run = current_time
+            return True
+
+        moving = self.motion(gray)
+        cv.accumulateWeighted(gray, self.background, self.learning_rate)
+        if moving or current_time - self.last_run >= self.keepalive:
+            self.last_run = current_time
+            return True
+        self.skipped += 1
+        return False
@@ -0,0 +1,215 @@
+import numpy as np
+
+from filtering import CLASS_ID, CONFIDENCE, ID
+
+def box_iou(a, b):
+    # (N, 4+) x (M, 4+) xyxy boxes -> (N, M) IoU matrix
+    x_min = np.maximum(a[:, None, 0], b[None, :, 0])
+    y_min = np.maximum(a[:, None, 1], b[None, :, 1])
+    x_max = np.minimum(a[:, None, 2], b[None, :, 2])
+    y_max = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x_max - x_min, 0, None) * np.clip(y_max - y_min, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+def greedy_match(overlaps, threshold):
+    # (row, col) pairs in descending IoU order, each row and column used once
+    rows, cols = np.nonzero(overlaps >= threshold)
+    order = np.argsort(-overlaps[rows, cols], kind="stable")
+    used_rows, used_cols, pairs = set(), set(), []
+    for r, c in zip(rows[order], cols[order]):
+        if r not in used_rows and c not in used_cols:
+            used_rows.add(r)
+            used_cols.add(c)
+            pairs.append((r, c))
+    return pairs
+
+def to_state(boxes):
+    w, h = boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]
+    return np.column_stack([boxes[:, 0] + w / 2, boxes[:, 1] + h / 2, w, h])
+
+class KalmanTracks:
+    # constant-velocity Kalman filter over all tracks at once. state per
+    # track is (cx, cy, w, h) and their velocities, in pixels and seconds.
+    # noise scales with box height: position_noise is the measurement error,
+    # velocity_noise how fast velocity may drift (box heights/s per sqrt(s)).
+    # velocity is seeded from a track's first two matches, not learnt from zero
+    def __init__(self, match_iou=0.3, max_misses=2, position_noise=1 / 20, velocity_noise=1.0):
+        self.match_iou = match_iou
+        self.max_misses = max_misses
+        self.position_noise = position_noise
+        self.velocity_noise = velocity_noise
+        self.reset()
+
+    def reset(self):
+        self.x = np.zeros((0, 8))
+        self.P = np.zeros((0, 8, 8))
+        # id, confidence, class_id of the last matching detection
+        self.info = np.zeros((0, 3), dtype=np.float32)
+        self.misses = np.zeros(0, dtype=np.int32)
+        # matched updates so far and the time of the last one
+        self.hits = np.zeros(0, dtype=np.int32)
+        self.matched = np.zeros(0)
+        self.time = None
+
+    def __len__(self):
+        return len(self.x)
+
+    def covariance(self, h, position, velocity):
+        std = np.column_stack([np.repeat((position * h)[:, None], 4, 1), np.repeat((velocity * h)[:, None], 4, 1)])
+        return np.einsum("ni,ij->nij", std ** 2, np.eye(8))
+
+    def predict(self, current_time):
+        dt = 0.0 if self.time is None else current_time - self.time
+        self.time = current_time
+        if not len(self.x) or dt <= 0:
+            return
+        F = np.eye(8)
+        F[:4, 4:] = dt * np.eye(4)
+        self.x = self.x @ F.T
+        h = np.maximum(self.x[:, 3], 1.0)
+        Q = self.covariance(h, self.position_noise * np.sqrt(dt), self.velocity_noise * np.sqrt(dt))
+        self.P = F @ self.P @ F.T + Q
+        self.x[:, 2:4] = np.maximum(self.x[:, 2:4], 1.0)
+
+    def correct(self, index, measured, current_time):
+        # batched Kalman update of tracks[index] with (cx, cy, w, h) measurements
+        seed = self.hits[index] == 1
+        if seed.any():
+            # second match: velocity straight from the two measurements
+            tracks, z = index[seed], measured[seed]
+            dt = np.maximum(current_time - self.matched[tracks], 1e-3)
+            self.x[tracks, 4:] = (z - self.x[tracks, :4]) / dt[:, None]
+            self.x[tracks, :4] = z
+            h = np.maximum(z[:, 3], 1.0)
+            self.P[tracks] = self.covariance(h, self.position_noise, 2 * self.position_noise / dt)
+        index, measured = index[~seed], measured[~seed]
+        if len(index):
+            P = self.P[index]
+            h = np.maximum(self.x[index, 3], 1.0)
+            S = P[:, :4, :4] + self.covariance(h, self.position_noise, 0)[:, :4, :4]
+            K = np.linalg.solve(S, P[:, :4, :]).transpose(0, 2, 1)
+            self.x[index] += np.einsum("nij,nj->ni", K, measured - self.x[index, :4])
+            self.P[index] = P - K @ P[:, :4, :]
+
+    def spawn(self, detections, current_time):
+        n = len(detections)
+        x = np.zeros((n, 8))
+        x[:, :4] = to_state(detections)
+        # velocity unknown until the second match
+        P = self.covariance(np.maximum(x[:, 3], 1.0), self.position_noise, 10.0)
+        self.x = np.concatenate([self.x, x])
+        self.P = np.concatenate([self.P, P])
+        self.info = np.concatenate([self.info, detections[:, [ID, CONFIDENCE, CLASS_ID]]])
+        self.misses = np.concatenate([self.misses, np.zeros(n, dtype=np.int32)])
+        self.hits = np.concatenate([self.hits, np.ones(n, dtype=np.int32)])
+        self.matched = np.concatenate([self.matched, np.full(n, current_time)])
+
+    def boxes(self):
+        # (N, 7) rows in the filtering layout for tracks seen at the last detection
+        live = self.misses == 0
+        cx, cy, w, h = self.x[live, :4].T
+        boxes = np.column_stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2, self.info[live]])
+        return boxes.astype(np.float32)
+
+    def update(self, detections, current_time):
+        # associates detections with the predicted tracks (same class, IoU),
+        # returns the number of detections that started a new track
+        self.predict(current_time)
+        overlaps = np.zeros((len(self.x), len(detections)))
+        if overlaps.size:
+            overlaps = box_iou(self.x_boxes(), detections)
+            # the detector's tracker already linked same-id boxes: those win
+            same_id = (self.info[:, 0][:, None] == detections[None, :, ID]) & (detections[None, :, ID] >= 0)
+            overlaps = np.where(same_id, 1.0 + overlaps, overlaps)
+            overlaps[self.info[:, 2][:, None] != detections[None, :, CLASS_ID]] = 0
+        pairs = greedy_match(overlaps, self.match_iou)
+        matched_tracks = np.array([t for t, _ in pairs], dtype=np.int64)
+        matched_detections = np.array([d for _, d in pairs], dtype=np.int64)
+        if len(pairs):
+            self.correct(matched_tracks, to_state(detections[matched_detections]), current_time)
+            self.info[matched_tracks] = detections[matched_detections][:, [ID, CONFIDENCE, CLASS_ID]]
+            self.hits[matched_tracks] += 1
+            self.matched[matched_tracks] = current_time
+        self.misses += 1
+        self.misses[matched_tracks] = 0
+        keep = self.misses <= self.max_misses
+        self.x, self.P, self.info = self.x[keep], self.P[keep], self.info[keep]
+        self.misses, self.hits, self.matched = self.misses[keep], self.hits[keep], self.matched[keep]
+        new = np.setdiff1d(np.arange(len(detections)), matched_detections)
+        self.spawn(detections[new], current_time)
+        return len(new)
+
+    def x_boxes(self):
+        cx, cy, w, h = self.x[:, :4].T
+        return np.column_stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2])
+
+    def settled(self):
+        # every live track has a velocity from at least two matches
+        return bool((self.hits[self.misses == 0] >= 2).all())
+
+    def speed(self):
+        # fastest live track, in box sizes per second
+        live = self.misses == 0
+        if not live.any():
+            return 0.0
+        size = np.maximum(self.x[live, 2:4].max(1), 1.0)
+        return float((np.hypot(self.x[live, 4], self.x[live, 5]) / size).max())
+
+class Interpolator:
+    # detect-every-N: ActivityMonitor runs the detector only when due() and
+    # gets Kalman-propagated boxes (same ids, classes, confidences) on the
+    # frames in between, so rules see every frame. N adapts to the scene:
+    # min_every while objects appear (until their velocity is known) or move
+    # fast, up to max_every while it is still, keeping motion between
+    # detections under motion_budget box sizes
+    def __init__(self, min_every=2, max_every=10, motion_budget=0.25, match_iou=0.3, max_misses=2):
+        self.min_every = min_every
+        self.max_every = max_every
+        self.motion_budget = motion_budget
+        self.tracks = KalmanTracks(match_iou, max_misses)
+        self.reset()
+
+    def reset(self):
+        self.tracks.reset()
+        self.every = self.min_every
+        self.since = None
+        self.frame_time = None
+        self.last_time = None
+        self.detections = 0
+        self.interpolated = 0
+
+    def due(self):
+        return self.since is None or self.since + 1 >= self.every
+
+    def tick(self, current_time):
+        # running estimate of the time between handled frames
+        if self.last_time is not None and current_time > self.last_time:
+            dt = current_time - self.last_time
+            self.frame_time = dt if self.frame_time is None else 0.8 * self.frame_time + 0.2 * dt
+        self.last_time = current_time
+
+    def predict(self, current_time):
+        self.tick(current_time)
+        self.since += 1
+        self.interpolated += 1
+        self.tracks.predict(current_time)
+        return self.tracks.boxes()
+
+    def update(self, detections, current_time):
+        self.tick(current_time)
+        self.since = 0
+        self.detections += 1
+        spawned = self.tracks.update(detections, current_time)
+        self.every = self.adapt(spawned)
+        return detections
+
+    def adapt(self, spawned):
+        if spawned or self.frame_time is None or not self.tracks.settled():
+            return self.min_every
+        motion = self.tracks.speed() * self.frame_time
+        if motion <= 0:
+            return self.max_every
+        return int(np.clip(self.motion_budget // motion, self.min_every, self.max_every))
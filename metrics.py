@@ -0,0 +1,250 @@
+import bisect
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STAGES = ("decode", "inference", "filtering", "rules", "alert_encoding")
+# seconds; covers a grab() (~0.1ms) up to a slow CPU forward pass (~2s)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+IMPORTED = time.monotonic()
+
+def process_age():
+    # seconds since this process started, interpreter startup and imports
+    # included (Linux); elsewhere since this module was imported
+    try:
+        with open("/proc/self/stat") as f:
+            started = int(f.read().rsplit(")", 1)[1].split()[19]) / os.sysconf("SC_CLK_TCK")
+        with open("/proc/uptime") as f:
+            return float(f.read().split()[0]) - started
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - IMPORTED
+
+@contextmanager
+def timed(metrics, name):
+    # no-op when no metrics are attached
+    if metrics is None:
+        yield
+    else:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            metrics.record(name, time.perf_counter() - start)
+
+class StageTimer:
+    # keeps every sample, for exact percentiles in short benchmark runs.
+    # use Metrics for long-running processes.
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.counters = defaultdict(int)
+        self.gauges = {}
+
+    @contextmanager
+    def stage(self, name):
+        with timed(self, name):
+            yield
+
+    def record(self, name, seconds):
+        self.samples[name].append(seconds)
+
+    def count(self, name, n=1, **labels):
+        self.counters[(name,) + tuple(sorted(labels.items()))] += n
+
+    def set(self, name, value):
+        self.gauges[name] = value
+
+    def percentiles(self, qs=(50, 90, 99)):
+        import numpy as np
+        report = {}
+        for name, values in self.samples.items():
+            values = np.asarray(values) * 1000
+            report[name] = {"count": len(values), "mean_ms": float(values.mean())}
+            report[name].update({f"p{q}_ms": float(np.percentile(values, q)) for q in qs})
+        return report
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+class Metrics:
+    # constant-memory, always-on instrumentation for one camera: stage
+    # latency histograms, counters (optionally labelled) and gauges
+    def __init__(self, camera="DO01", fps_window=300):
+        self.camera = camera
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.histograms = defaultdict(Histogram)
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.processed = deque(maxlen=fps_window)
+
+    @contextmanager
+    def stage(self, name):
+        with timed(self, name):
+            yield
+
+    def record(self, name, seconds):
+        with self.lock:
+            self.histograms[name].observe(seconds)
+
+    def count(self, name, n=1, **labels):
+        with self.lock:
+            self.counters[(name,) + tuple(sorted(labels.items()))] += n
+            if name == "frames_processed":
+                self.processed.append(time.perf_counter())
+
+    def set(self, name, value):
+        self.gauges[name] = value
+
+    def processed_fps(self):
+        window = list(self.processed)
+        if len(window) < 2 or window[-1] == window[0]:
+            return 0.0
+        return (len(window) - 1) / (window[-1] - window[0])
+
+    def snapshot(self):
+        with self.lock:
+            stages = {
+                name: {"count": h.count, "sum": h.sum, "p50": h.quantile(0.5), "p90": h.quantile(0.9), "p99": h.quantile(0.99)}
+                for name, h in self.histograms.items()
+            }
+            counters = {"/".join([key[0]] + [f"{k}={v}" for k, v in key[1:]]): n for key, n in self.counters.items()}
+        return {
+            "camera": self.camera,
+            "uptime": time.time() - self.started,
+            "processed_fps": self.processed_fps(),
+            "gauges": dict(self.gauges),
+            "counters": counters,
+            "stages": stages,
+        }
+
+    def samples(self, prefix="frasers"):
+        # (metric family, type, line) for every value of this camera
+        camera = f'camera="{self.camera}"'
+        samples = []
+        family = f"{prefix}_stage_seconds"
+        with self.lock:
+            for name, h in self.histograms.items():
+                labels = f'{camera},stage="{name}"'
+                cumulative = 0
+                for bound, n in zip(h.buckets, h.counts):
+                    cumulative += n
+                    samples.append((family, "histogram", f'{family}_bucket{{{labels},le="{bound}"}} {cumulative}'))
+                samples.append((family, "histogram", f'{family}_bucket{{{labels},le="+Inf"}} {h.count}'))
+                samples.append((family, "histogram", f'{family}_sum{{{labels}}} {h.sum}'))
+                samples.append((family, "histogram", f'{family}_count{{{labels}}} {h.count}'))
+            for key, n in self.counters.items():
+                labels = ",".join([camera] + [f'{k}="{v}"' for k, v in key[1:]])
+                samples.append((f"{prefix}_{key[0]}_total", "counter", f'{prefix}_{key[0]}_total{{{labels}}} {n}'))
+        for name, value in list(self.gauges.items()) + [("processed_fps", self.processed_fps())]:
+            samples.append((f"{prefix}_{name}", "gauge", f'{prefix}_{name}{{{camera}}} {value}'))
+        return samples
+
+    def prometheus(self, prefix="frasers"):
+        return exposition(self.samples(prefix))
+
+def exposition(samples):
+    # the text format wants each family's lines together under one # TYPE
+    families = {}
+    for family, kind, line in samples:
+        families.setdefault((family, kind), []).append(line)
+    lines = []
+    for (family, kind), values in families.items():
+        lines.append(f"# TYPE {family} {kind}")
+        lines.extend(values)
+    return lines
+
+class Registry:
+    def __init__(self):
+        self.cameras = {}
+
+    def camera(self, name):
+        if name not in self.cameras:
+            self.cameras[name] = Metrics(name)
+        return self.cameras[name]
+
+    def snapshot(self):
+        return {"time": time.time(), "cameras": [m.snapshot() for m in list(self.cameras.values())]}
+
+    def prometheus(self, prefix="frasers"):
+        samples = [sample for metrics in list(self.cameras.values()) for sample in metrics.samples(prefix)]
+        return "\n".join(exposition(samples)) + "\n"
+
+class JsonlSink(threading.Thread):
+    # appends one registry snapshot per interval to a JSONL file
+    def __init__(self, registry, path="metrics.jsonl", interval=10.0):
+        super().__init__(daemon=True)
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.stop = threading.Event()
+        self.start()
+
+    def write(self):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(self.registry.snapshot()) + "\n")
+
+    def run(self):
+        while not self.stop.wait(self.interval):
+            self.write()
+
+    def close(self):
+        self.stop.set()
+        self.join()
+        self.write()
+
+class MetricsServer:
+    # Prometheus text format on http://host:port/metrics (local only by default)
+    def __init__(self, registry, port=9108, host="127.0.0.1"):
+        registry_ = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") not in ("", "/metrics"):
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = registry_.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -1,78 +1,305 @@
-from ultralytics import YOLO
 import cv2 as cv
 import datetime
-import base64
-from collections import defaultdict
+
+from backends import get_model
+from engine import StreamTracker
+from pipeline import run_pipeline
+from zones import crop, crop_rect, offset_boxes, rect_polygon
+from filtering import to_numpy
+from render import annotate
+from alerts import AlertDispatcher
+from rules import DwellRule, rules_from_config
+from secondary import SecondaryScheduler
+from metrics import process_age, timed
+from schedule import Governor
 
 class ActivityMonitor:
-    def __init__(self, model_path, max_time=10, confidence_thresh=0.7, roi=None):
-        self.model = YOLO(model_path)
+    def __init__(self, model_path=None, max_time=10, confidence_thresh=0.7, roi=None, model=None,
+                 camera_number="DO01", motion_gate=None, crop_to_roi=False, crop_pad=0.1, zones=None,
+                 headless=False, preview=None, alerts=None, track_grace=5.0, reassociate_iou=0.5, rules=None,
+                 secondary=None, metrics=None, clips=None, schedule=None, interpolate=None):
+        # monitors given the same model_path share one warmed model (see
+        # backends.get_model); a *.onnx model_path runs on ONNX Runtime
+        self.model = model if model is not None else get_model(model_path)
         self.max_time = max_time
         self.confidence_thresh = confidence_thresh
         self.roi = roi
-    
-    def process_video(self, video, object_class, event_type, api_url):
+        # zones: arbitrary polygons in pixels; a rectangular roi is one zone
+        self.zones = zones or ([rect_polygon(roi)] if roi else None)
+        self.camera_number = camera_number
+        # optional gating.MotionGate; static frames reuse the last detections
+        self.motion_gate = motion_gate
+        # run the detector on the padded ROI only and map boxes back
+        self.crop_to_roi = crop_to_roi
+        self.crop_pad = crop_pad
+        self.crop_rects = {}
+        self.window = 'frame'
+        # headless skips drawing and windows; preview is an optional render.PreviewSink
+        self.headless = headless
+        self.preview = preview
+        self.alerts = alerts
+        self.track_grace = track_grace
+        self.reassociate_iou = reassociate_iou
+        # rules (or a rules.rules_from_config list) are all evaluated against
+        # the same detections; without them process_video builds one dwell
+        # rule from object_class/event_type as before
+        self.rules = rules_from_config(rules) if rules and isinstance(rules[0], dict) else rules
+        # secondary.SecondaryModel list; their detections are merged into
+        # the primary ones before the rules run
+        self.secondary = SecondaryScheduler(secondary) if secondary else None
+        # optional metrics.Metrics (or StageTimer) for stage latencies and counters
+        self.metrics = metrics
+        if alerts is not None and alerts.metrics is None:
+            alerts.metrics = metrics
+        # optional clips.ClipRecorder: alerts wait for its after-window and
+        # carry a clip or thumbnail strip from the camera's frame buffer
+        self.clips = clips
+        # optional schedule.Schedule (or list of schedule.Window kwargs):
+        # when to infer at which stride/size, keep-alive or nothing at all.
+        # it overrides process_video's stride and is re-read as time passes
+        self.governor = Governor(schedule) if schedule is not None and not isinstance(schedule, Governor) else schedule
+        # optional interpolate.Interpolator: the detector only runs every N
+        # sampled frames (adaptive), Kalman-propagated boxes fill the rest so
+        # dwell and zone rules still update on every sampled frame
+        self.interpolate = interpolate
+        # seconds from process start to the first handled frame
+        self.first_frame = None
+        self.reset()
+
+    def reset(self, fps=30):
+        if self.metrics is not None:
+            self.metrics.set("source_fps", fps)
+        for rule in self.rules or ():
+            rule.reset()
+        if self.secondary is not None:
+            self.secondary.reset()
+        if self.clips is not None:
+            self.clips.reset()
+        if self.governor is not None:
+            self.governor.reset()
+        if self.interpolate is not None:
+            self.interpolate.reset()
+        self.crop_rects = {}
+        self.tracker = StreamTracker(fps)
+        self.last_detections = None
+
+    def dwell_rule(self, object_class, event_type):
+        return DwellRule(event_type, (object_class,), self.max_time, self.track_grace, self.reassociate_iou,
+                         confidence=self.confidence_thresh, zones=self.zones)
+
+    def active_rules(self, object_class=None, event_type=None):
+        if object_class is None:
+            if not self.rules:
+                raise ValueError("either rules or object_class/event_type are required")
+            return self.rules
+        # legacy single-scenario call replaces the rule list
+        self.rules = [self.dwell_rule(object_class, event_type)]
+        return self.rules
+
+    def crop_rect(self, frame):
+        # fixed per frame size, which keeps tracker ids stable across frames.
+        # only possible when every rule is restricted to a zone
+        if not self.crop_to_roi or not self.rules:
+            return None
+        shape = frame.shape[:2]
+        if shape not in self.crop_rects:
+            masks = [rule.zone_mask(frame) for rule in self.rules]
+            if any(mask is None for mask in masks):
+                self.crop_rects[shape] = None
+            else:
+                self.crop_rects[shape] = crop_rect([b for mask in masks for b in mask.bounds()], shape, self.crop_pad)
+        return self.crop_rects[shape]
+
+    def detect(self, frame):
+        rect = self.crop_rect(frame)
+        # the active schedule window may ask for a smaller input size
+        options = {"imgsz": self.governor.imgsz} if self.governor is not None and self.governor.imgsz else {}
+        if rect is None:
+            results = self.model.predict(frame, verbose=False, **options)
+            return self.tracker.update(results[0], frame)
+        cropped = crop(frame, rect)
+        results = self.model.predict(cropped, verbose=False, **options)
+        return offset_boxes(self.tracker.update(results[0], cropped), rect[0], rect[1])
+
+    def sampled(self, current_frame, current_time, stride):
+        if self.governor is not None:
+            return self.governor.sample(current_frame, current_time)
+        return current_frame % stride == 0
+
+    def detect_gated(self, frame, current_time):
+        # skipped frames don't advance the tracker, so tracks aren't aged out
+        # and dwell timers keep counting from the reused detections
+        if self.interpolate is not None and self.last_detections is not None and not self.interpolate.due():
+            with timed(self.metrics, "interpolate"):
+                self.last_detections = self.interpolate.predict(current_time)
+            if self.metrics is not None:
+                self.metrics.count("frames_interpolated")
+            return self.last_detections
+        if self.last_detections is None or self.motion_gate is None or self.motion_gate.check(frame, current_time):
+            with timed(self.metrics, "inference"):
+                self.last_detections = self.detect(frame)
+            if self.interpolate is not None:
+                self.interpolate.update(self.last_detections, current_time)
+                if self.metrics is not None:
+                    self.metrics.set("detect_every", self.interpolate.every)
+        elif self.metrics is not None:
+            self.metrics.count("frames_gated")
+        return self.last_detections
+
+    def process_video(self, video, object_class=None, event_type=None, api_url=None, stride=3, pipelined=False, queue_size=4, drop_policy="block"):
+        rules = self.active_rules(object_class, event_type)
+        if pipelined:
+            return self.process_video_pipelined(video, rules, api_url, stride, queue_size, drop_policy)
+
         cap = cv.VideoCapture(video)
-        start_times = defaultdict(lambda: None)
-        triggers = defaultdict(lambda: False)
-        notifications = defaultdict(lambda: False)
         fps = cap.get(cv.CAP_PROP_FPS)
-        
+        self.reset(fps)
+
         while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret: break
-            
-            current_frame = int(cap.get(cv.CAP_PROP_POS_FRAMES))
+            # frames that won't be processed are only grabbed, never decoded
+            current_frame = int(cap.get(cv.CAP_PROP_POS_FRAMES)) + 1
             current_time = current_frame / fps
-            if current_frame % 3 == 0:
-                results = self.model.track(frame, persist=True, verbose=False)
-                detections = results[0].boxes.data
-                
-                for detection in detections:
-                    x_min, y_min, x_max, y_max, *rest = detection
-                    confidence, class_id = rest[-2:]
-                    obj_id = int(rest[0]) if len(rest) == 3 else None
-                    
-                    if confidence >= self.confidence_thresh and int(class_id) == object_class:
-                        if self.roi:
-                            if not (self.roi[0] < (x_min + x_max) / 2 < self.roi[2] and self.roi[1] < y_max < self.roi[3]):
-                                continue
-                        
-                        cv.rectangle(frame, (int(x_min), int(y_min)), (int(x_max), int(y_max)), (255, 0, 0), 4)
-                        
-                        if not triggers[obj_id]:
-                            triggers[obj_id] = True
-                            start_times[obj_id] = current_time
-                        
-                        elapsed_time = current_time - start_times[obj_id]
-                        cv.putText(frame, f"Duration: {int(elapsed_time)}s", (int(x_max)-100, int(y_min)-50), cv.FONT_HERSHEY_SIMPLEX, 0.5, (0,0,255))
-                        
-                        if elapsed_time >= self.max_time and not notifications[obj_id]:
-                            self.send_alert(frame, event_type, api_url)
-                            notifications[obj_id] = True
-                
-                cv.imshow('frame', frame)
-                if cv.waitKey(1) & 0xFF == ord('q'):
+            sampled = self.sampled(current_frame, current_time, stride)
+            with timed(self.metrics, "decode"):
+                ret, frame = cap.read() if sampled else (cap.grab(), None)
+            if not ret: break
+
+            if self.metrics is not None:
+                self.metrics.count("frames_read")
+                if not sampled:
+                    self.metrics.count("frames_skipped")
+            if sampled:
+                detections = self.detect_gated(frame, current_time)
+                if not self.handle_frame(frame, detections, current_time, rules, api_url):
                     break
-        
+
         cap.release()
-        cv.destroyAllWindows()
-    
-    def send_alert(self, frame, event_type, api_url):
-        api_post = {
+        self.flush_alerts(api_url)
+        if not self.headless:
+            cv.destroyAllWindows()
+
+    def process_video_pipelined(self, video, rules, api_url, stride=3, queue_size=4, drop_policy="block"):
+        # decode, inference and rules/drawing run on separate threads
+        cap = cv.VideoCapture(video)
+        fps = cap.get(cv.CAP_PROP_FPS)
+        cap.release()
+        self.reset(fps)
+        stats = run_pipeline(
+            video, self.detect_gated,
+            lambda frame, detections, current_time: self.handle_frame(
+                frame, detections, current_time, rules, api_url),
+            stride=stride, queue_size=queue_size, drop_policy=drop_policy, metrics=self.metrics,
+            sample=self.sampled if self.governor is not None else None,
+        )
+        self.flush_alerts(api_url)
+        if not self.headless:
+            cv.destroyAllWindows()
+        return stats
+
+    def flush_alerts(self, api_url=None):
+        # alerts still inside their clip's after-window go out with what was buffered
+        if self.clips is not None:
+            for payload, snapshot in self.clips.ready():
+                self.dispatcher(api_url).submit(payload, snapshot)
+        if self.alerts is not None:
+            self.alerts.flush()
+
+    def attach(self, engine, name, video, object_class=None, event_type=None, api_url=None, stride=3):
+        # run this monitor as one stream of a shared MultiStreamEngine
+        self.window = name
+        rules = self.active_rules(object_class, event_type)
+        stream = engine.add_stream(name, video, None, stride=stride, gate=self.motion_gate, crop=self.crop_rect,
+                                   metrics=self.metrics, governor=self.governor)
+        self.reset(stream.fps)
+        stream.handler = lambda frame, detections, current_time: self.handle_frame(
+            frame, detections, current_time, rules, api_url)
+        return stream
+
+    def handle_frame(self, frame, detections, current_time, rules, api_url):
+        if self.clips is not None:
+            # before anything is drawn on it
+            self.clips.buffer.push(frame, current_time)
+        with timed(self.metrics, "filtering"):
+            detections = to_numpy(detections)
+            if self.secondary is not None:
+                detections = self.secondary.update(frame, detections)
+        evaluated = []
+        fired = []
+        with timed(self.metrics, "rules"):
+            for rule in rules:
+                selected, labels, alert = rule.evaluate(frame, detections, current_time)
+                evaluated.append((selected, labels))
+                if alert:
+                    fired.append(rule)
+
+        # headless: nothing is drawn unless the frame is actually used
+        if not self.headless:
+            self.draw(frame, evaluated)
+        elif self.preview is not None and self.preview.due():
+            self.preview.write(self.draw(frame.copy(), evaluated))
+
+        if self.first_frame is None:
+            self.first_frame = process_age()
+            print(f"{self.camera_number}: first frame {self.first_frame:.2f}s after start")
+            if self.metrics is not None:
+                self.metrics.set("time_to_first_frame", self.first_frame)
+        if self.metrics is not None:
+            self.metrics.count("frames_processed")
+            self.metrics.set("video_time", current_time)
+            self.metrics.set("live_tracks", sum(len(rule.tracks) for rule in rules if hasattr(rule, "tracks")))
+            for rule in fired:
+                self.metrics.count("alerts", event_type=rule.event_type)
+
+        if fired:
+            snapshot = frame if not self.headless else self.draw(frame.copy(), evaluated)
+            for rule in fired:
+                if self.clips is None:
+                    self.send_alert(snapshot, rule.event_type, api_url)
+                else:
+                    self.clips.add(self.alert_payload(rule.event_type), snapshot, current_time)
+        if self.clips is not None:
+            for payload, snapshot in self.clips.ready(current_time):
+                self.dispatcher(api_url).submit(payload, snapshot)
+
+        if self.headless:
+            return True
+        cv.imshow(self.window, frame)
+        return not (cv.waitKey(1) & 0xFF == ord('q'))
+
+    def draw(self, frame, evaluated):
+        for selected, labels in evaluated:
+            annotate(frame, selected, labels)
+        return frame
+
+    def alert_payload(self, event_type):
+        return {
             "building": "AP",
-            "camera_number": "DO01",
+            "camera_number": self.camera_number,
             "event_date": datetime.datetime.now().isoformat(),
             "event_type": event_type,
             "image": None,
         }
-        
-        _, buffer = cv.imencode('.jpg', cv.resize(frame, (0, 0), fx=0.5, fy=0.5))
-        api_post["image"] = base64.b64encode(buffer).decode('utf-8')
-        # Uncomment to send request
-        # requests.post(api_url, json=api_post)
-        print(f"Alert Sent: {api_post}")
+
+    def dispatcher(self, api_url):
+        # encoding and delivery happen on the dispatcher's worker thread;
+        # pass alerts=AlertDispatcher(api_url) to actually post
+        if self.alerts is None:
+            self.alerts = AlertDispatcher(api_url, dry_run=True, metrics=self.metrics)
+        return self.alerts
+
+    def send_alert(self, frame, event_type, api_url):
+        self.dispatcher(api_url).submit(self.alert_payload(event_type), frame)
 
 if __name__ == '__main__':
     monitor = ActivityMonitor("weights/yolov9m.pt", max_time=10, confidence_thresh=0.7, roi=(0, 0, 600, 550))
     monitor.process_video("cctv/carpark.mp4", object_class=2, event_type="SC05", api_url="https://example.com/api_endpoint")
+
+    # several scenarios on one camera share a single decode + inference pass
+    camera = [
+        {"type": "dwell", "event_type": "SC01", "classes": [2], "max_time": 10, "confidence": 0.8},
+        {"type": "zone", "event_type": "SC03", "classes": [2], "zone": [(0, 0.35), (0.8, 0.35), (0.8, 1), (0, 1)], "relative": True},
+        {"type": "time_window", "event_type": "SC04", "classes": [0], "confidence": 0.55, "start": 18, "end": 6},
+        {"type": "occupancy", "event_type": "SC05", "classes": [2], "confidence": 0.7, "max_count": 8, "duration": 10},
+    ]
+    monitor = ActivityMonitor("weights/yolov9m.pt", rules=camera)
+    monitor.process_video("cctv/carpark.mp4", api_url="https://example.com/api_endpoint")
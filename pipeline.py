@@ -0,0 +1,129 @@
+import queue
+import threading
+import cv2 as cv
+
+from metrics import timed
+
+STOP = object()
+
+class FrameQueue:
+    # bounded queue; "block" applies backpressure upstream, "drop_oldest"
+    # keeps only the freshest items (useful for live cameras)
+    def __init__(self, maxsize=4, policy="block", metrics=None):
+        if policy not in ("block", "drop_oldest"):
+            raise ValueError(f"unknown drop policy: {policy}")
+        self.q = queue.Queue(maxsize=maxsize)
+        self.policy = policy
+        self.metrics = metrics
+        self.dropped = 0
+
+    def put(self, item, stop):
+        if self.policy == "drop_oldest" and item is not STOP:
+            while True:
+                try:
+                    self.q.put_nowait(item)
+                    return
+                except queue.Full:
+                    try:
+                        self.q.get_nowait()
+                        self.dropped += 1
+                        if self.metrics is not None:
+                            self.metrics.count("frames_dropped")
+                    except queue.Empty:
+                        pass
+        while not stop.is_set():
+            try:
+                self.q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def get(self, stop):
+        while not stop.is_set():
+            try:
+                return self.q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return STOP
+
+class FrameReader(threading.Thread):
+    def __init__(self, video, out, stop, stride=3, metrics=None, sample=None):
+        super().__init__(daemon=True)
+        # sample(current_frame, current_time, stride) -> bool replaces the
+        # fixed stride (see ActivityMonitor.sampled)
+        self.sample = sample
+        self.metrics = metrics
+        self.cap = cv.VideoCapture(video)
+        self.fps = self.cap.get(cv.CAP_PROP_FPS) or 30
+        self.out = out
+        self.stop = stop
+        self.stride = stride
+
+    def run(self):
+        try:
+            while self.cap.isOpened() and not self.stop.is_set():
+                # grab() only demuxes, so skipped frames are never decoded
+                current_frame = int(self.cap.get(cv.CAP_PROP_POS_FRAMES))
+                if self.sample is not None:
+                    sampled = self.sample(current_frame + 1, (current_frame + 1) / self.fps, self.stride)
+                else:
+                    sampled = (current_frame + 1) % self.stride == 0
+                if not sampled:
+                    with timed(self.metrics, "decode"):
+                        grabbed = self.cap.grab()
+                    if not grabbed: break
+                    if self.metrics is not None:
+                        self.metrics.count("frames_read")
+                        self.metrics.count("frames_skipped")
+                    continue
+                with timed(self.metrics, "decode"):
+                    ret, frame = self.cap.read()
+                if not ret: break
+                if self.metrics is not None:
+                    self.metrics.count("frames_read")
+                current_frame += 1
+                self.out.put((current_frame, current_frame / self.fps, frame), self.stop)
+        finally:
+            self.cap.release()
+            self.out.put(STOP, self.stop)
+
+class InferenceStage(threading.Thread):
+    def __init__(self, detect, inp, out, stop):
+        super().__init__(daemon=True)
+        self.detect = detect
+        self.inp = inp
+        self.out = out
+        self.stop = stop
+
+    def run(self):
+        while True:
+            item = self.inp.get(self.stop)
+            if item is STOP:
+                self.out.put(STOP, self.stop)
+                return
+            current_frame, current_time, frame = item
+            self.out.put((current_frame, current_time, frame, self.detect(frame, current_time)), self.stop)
+
+def run_pipeline(video, detect, handle, stride=3, queue_size=4, drop_policy="block", metrics=None, sample=None):
+    # reader thread -> inference thread -> handle() on the calling thread,
+    # which also owns any cv.imshow windows. handle() returning False stops.
+    stop = threading.Event()
+    frames = FrameQueue(queue_size, drop_policy, metrics)
+    results = FrameQueue(queue_size, drop_policy, metrics)
+    reader = FrameReader(video, frames, stop, stride, metrics, sample)
+    inference = InferenceStage(detect, frames, results, stop)
+    reader.start()
+    inference.start()
+    try:
+        while True:
+            item = results.get(stop)
+            if item is STOP:
+                break
+            current_frame, current_time, frame, detections = item
+            if handle(frame, detections, current_time) is False:
+                break
+    finally:
+        stop.set()
+        reader.join()
+        inference.join()
+    return {"fps": reader.fps, "dropped": frames.dropped + results.dropped}
@@ -0,0 +1,29 @@
+import os
+import cv2 as cv
+
+def annotate(frame, detections, labels=None, color=(255, 0, 0)):
+    # draws in place; pass frame.copy() to keep the source frame clean
+    for i, (x_min, y_min, x_max, y_max, *_) in enumerate(detections):
+        cv.rectangle(frame, (int(x_min), int(y_min)), (int(x_max), int(y_max)), color, 4)
+        if labels and labels[i]:
+            cv.putText(frame, labels[i], (int(x_max)-100, int(y_min)-50), cv.FONT_HERSHEY_SIMPLEX, 0.5, (0,0,255))
+    return frame
+
+class PreviewSink:
+    # low-rate replacement for cv.imshow on headless servers: every Nth frame
+    # is annotated and written to disk (overwriting one file unless keep=True)
+    def __init__(self, directory="preview", every=25, name="frame", keep=False):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.every = every
+        self.name = name
+        self.keep = keep
+        self.count = 0
+
+    def due(self):
+        self.count += 1
+        return self.count % self.every == 1 or self.every == 1
+
+    def write(self, frame):
+        name = f"{self.name}_{self.count:08d}.jpg" if self.keep else f"{self.name}.jpg"
+        cv.imwrite(os.path.join(self.directory, name), frame)
@@ -1,20 +1,35 @@
-import base64
 import cv2
-import datetime
-from collections import defaultdict
-from ultralytics import YOLO 
+from filtering import ID, filter_detections
+from alerts import default_dispatcher, draw_and_submit
+from backends import get_model
+from engine import StreamTracker
+from tracks import TrackStore
+from archive import sample
+from cache import DetectionCache
 
-def dropoff_car(video):
-    model = YOLO("weights/yolov9m.pt")
+def draw(frame, cars, labels, current_time):
+    cv2.putText(frame, f"Time: {current_time}", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+    for (x_min, y_min, x_max, y_max, id, *_), label in zip(cars, labels):
+        cv2.putText(frame, f"({int(id)})",(int(x_min), int(y_min) - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+        cv2.rectangle(frame, (int(x_min), int(y_min)), (int(x_max), int(y_max)), (255, 0, 0), 4)
+        cv2.putText(frame, label, (int(x_max)-100, int(y_min)-50), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,0,255))
+    return frame
+
+def dropoff_car(video, headless=False, alerts=None, cache=None):
+    model = get_model("weights/yolov9m.pt")
     cap = cv2.VideoCapture(video)
     
-    start_times = defaultdict(lambda: None)
-    triggers = defaultdict(lambda: False)
-    notifications = defaultdict(lambda: False)
+    tracks = TrackStore(grace=5.0)
     
     fps = cap.get(cv2.CAP_PROP_FPS)
-    r = {}
-    cars = []
+    tracker = StreamTracker(fps)
+    # every frame's detections (all classes, with track ids) go to the
+    # on-disk cache instead of an in-memory dict, so other thresholds and
+    # scenarios can be replayed later (see cache.py) without re-inference
+    writer = None
+    if cache is not None:
+        key = cache.key(video, "weights/yolov9m.pt", 3)
+        writer = cache.writer(key, video=video, model="weights/yolov9m.pt", stride=3, fps=fps)
     
     maximum_allowed_time = 10 # set to 10 seconds for testing
 
@@ -27,57 +42,46 @@ def dropoff_car(video):
     }
 
     api_url = "https://example.com/api_endpoint"  
+    alerts = default_dispatcher(alerts, api_url)
 
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret: break
-        current_frame = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    stopped = False
+    # every 3rd frame from frame 0, as cache.record samples it: both write
+    # the same cache key, so they must write the same frame indices
+    for current_frame, frame in sample(cap, 0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 3):
         current_time = current_frame // fps
-        if current_frame % 3 == 0:
-            cv2.putText(frame, f"Time: {current_time}", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-            results = model.track(frame, persist=True, verbose=False)
-            detections = results[0].boxes.data
-            track_ids = [int(d[4]) for d in detections if d[5] > 0.8 and d[-1] == 2]
-            for detection in detections:
-                if len(detection) == 7:
-                    x_min, y_min, x_max, y_max, id, confidence, class_id = detection
-                else:
-                    x_min, y_min, x_max, y_max, confidence, class_id = detection
-                    id = None
-                if confidence > 0.8 and int(class_id) == 2:
-                    cars.append(detection)
-                    car_id = int(id)
-                    cv2.putText(frame, f"({int(id)})",(int(x_min), int(y_min) - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-                    cv2.rectangle(frame, (int(x_min), int(y_min)), (int(x_max), int(y_max)), (255, 0, 0), 4)
-                    if not triggers[car_id]:
-                        triggers[car_id] = True
-                        start_times[car_id] = current_time
-                    elapsed_time = current_time - start_times[car_id]
-                    cv2.putText(frame, f"Duration: {int(elapsed_time)}s", (int(x_max)-100, int(y_min)-50), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,0,255))
-                    if int(elapsed_time) >= maximum_allowed_time and not notifications[car_id]:
-                        api_post = api_post_template
-                        api_post["event_date"] = datetime.datetime.now().isoformat()
-                        resized_frame = cv2.resize(frame, (0, 0), fx=0.5, fy=0.5)
-                        print(api_post_template)
-                        # Convert the resized frame to base64
-                        _, buffer = cv2.imencode('.jpg', resized_frame)
-                        api_post["image"] = base64.b64encode(buffer).decode('utf-8')
-                        # try:
-                        #     response = requests.post(api_url, json=api_post)
-                        #     response.raise_for_status()
-                        #     print(f"API call successful: {response.text}")
-                        # except requests.exceptions.RequestException as e:
-                        #     print(f"API call failed: {e}")
-                        notifications[car_id] = True
+        detections = tracker.update(model.predict(frame, verbose=False)[0], frame)
+        cars = filter_detections(detections, confidence=0.8, classes=(2,), tracked=True)
+        labels = []
+        alert = False
+        present = {int(i) for i in cars[:, ID]}
+        for x_min, y_min, x_max, y_max, id, confidence, class_id in cars:
+            car_id = int(id)
+            track = tracks.update(car_id, current_time, (x_min, y_min, x_max, y_max), present)
+            elapsed_time = track.dwell(current_time)
+            labels.append(f"Duration: {int(elapsed_time)}s")
+            if int(elapsed_time) >= maximum_allowed_time and not track.alerted:
+                alert = True
+                track.alerted = True
+        tracks.evict(current_time)
+        draw_and_submit(alerts, api_post_template, frame, lambda f: draw(f, cars, labels, current_time), headless, alert)
+        if writer is not None:
+            writer.append(current_frame, detections)
+            writer.meta["shape"] = frame.shape
+        if not headless:
             cv2.imshow('frame', frame)
-            r[current_frame] = cars
             if cv2.waitKey(1) & 0xFF == ord('q'):
+                stopped = True
                 break
     cap.release()
-    cv2.destroyAllWindows()
-    return r
+    alerts.flush()
+    if not headless:
+        cv2.destroyAllWindows()
+    if writer is not None:
+        # a run stopped early with 'q' is kept but never replayed
+        writer.close(complete=not stopped)
+        return cache.open(key)
 
 if __name__ == '__main__':
     # video = sys.argv[1]
     video = 'cctv/dropoff_loitering.mp4'
-    results = dropoff_car(video)
+    detections = dropoff_car(video, cache=DetectionCache())
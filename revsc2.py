@@ -1,118 +1,87 @@
-import base64
 import cv2
-import datetime
-from collections import defaultdict
-from ultralytics import YOLO
+from alerts import default_dispatcher, draw_and_submit
+from backends import get_model
+from engine import StreamTracker
+from filtering import ID, filter_detections
+from secondary import SecondaryModel, SecondaryScheduler
+from tracks import TrackStore
 
-def person_or_package(video):
-    model = YOLO("weights/yolov9m.pt")
-    package_model = YOLO("weights/package.pt")
+# package.pt classes are shifted past the primary model's (package = 0 -> 100)
+PACKAGE = 100
+
+def draw(frame, objects, labels):
+    for (x_min, y_min, x_max, y_max, id, *_), text in zip(objects, labels):
+        cv2.putText(
+            frame,
+            f"({int(id)})",
+            (int(x_min), int(y_min)-10),
+            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2
+        )
+        cv2.rectangle(
+            frame,
+            (int(x_min), int(y_min)),
+            (int(x_max), int(y_max)),
+            (255, 0, 0), 4
+        )
+        cv2.putText(
+            frame,
+            text,
+            (int(x_max) - 100, int(y_min) - 10),
+            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255)
+        )
+    return frame
+
+def person_or_package(video, headless=False, alerts=None, package_every=5, package_weights="weights/package.pt"):
+    model = get_model("weights/yolov9m.pt")
+    # the package detector runs every `package_every` frames and its
+    # detections are held in between (see secondary.SecondaryModel);
+    # package_weights may be an ONNX export (see backends.py)
+    packages = SecondaryScheduler([
+        SecondaryModel(get_model(package_weights), every=package_every, class_offset=PACKAGE),
+    ])
     cap = cv2.VideoCapture(video)
-    start_times = defaultdict(lambda: None)
-    triggers = defaultdict(lambda: False)
-    notifications = defaultdict(lambda: False)
+    tracks = TrackStore(grace=5.0)
     fps = cap.get(cv2.CAP_PROP_FPS)
-    
-    # api_post_template = {
-    #     "building": "AP",
-    #     "camera_number": "DO01",
-    #     "event_date": None,
-    #     "event_type": "SC02",
-    #     "image": None,
-    # }
-    
+    tracker = StreamTracker(fps)
+
+    api_post_template = {
+        "building": "AP",
+        "camera_number": "DO01",
+        "event_date": None,
+        "event_type": "SC02",
+        "image": None,
+    }
+    alerts = default_dispatcher(alerts)
+
     while cap.isOpened():
         ret, frame = cap.read()
         if not ret: break
         current_frame = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
         current_time = current_frame / fps
         if current_frame % 1 == 0:
-            results = model.track(frame, persist=True, verbose=False)
-            results2 = package_model.track(frame, persist=True, verbose=True)
-            detections = results[0].boxes.data
-            packages = results2[0].boxes.data
-            for package in packages:
-                if len(detection) == 7:
-                    x_min, y_min, x_max, y_max, id, confidence, class_id = detection
-                else:
-                    x_min, y_min, x_max, y_max, confidence, class_id = detection
-                    id = None
-                    person_id = int(id)
-                    cv2.putText(
-                        frame,
-                        f"({int(id)})",
-                        (int(x_min), int(y_min)-10),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2
-                    )
-                    cv2.rectangle(
-                        frame,
-                        (int(x_min), int(y_min)),
-                        (int(x_max), int(y_max)),
-                        (255, 0, 0), 4
-                    )
-                    if not triggers[person_id]:
-                        triggers["-1"] = True
-                        start_times["-1"] = current_time
-                    elapsed_time = current_time - start_times[person_id]
-                    text = f"Duration : {int(elapsed_time)}s"
-                    cv2.putText(
-                        frame,
-                        text,
-                        (int(x_max) - 100, int(y_min) - 10),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255)
-                    )
-                    if int(elapsed_time) >= 10 and not notifications[person_id]: 
-                        # api_post = api_post_template
-                        # api_post["event_date"] = datetime.datetime.now().isoformat()
-                        # resized_frame = cv2.resize(frame, (0, 0), fx=0.5, fy=0.5)
-                        # _, buffer = cv2.imencode('.jpg', resized_frame)
-                        # api_post["image"] = base64.b64encode(buffer).decode('utf-8')
-                        print("Notification triggered")
-                        notifications["-1"] = True
-            for detection in detections:
-                if len(detection) == 7:
-                    x_min, y_min, x_max, y_max, id, confidence, class_id = detection
-                else:
-                    x_min, y_min, x_max, y_max, confidence, class_id = detection
-                    id = None
-                if id and int(class_id) == 0:
-                    person_id = int(id)
-                    cv2.putText(
-                        frame,
-                        f"({int(id)})",
-                        (int(x_min), int(y_min)-10),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2
-                    )
-                    cv2.rectangle(
-                        frame,
-                        (int(x_min), int(y_min)),
-                        (int(x_max), int(y_max)),
-                        (255, 0, 0), 4
-                    )
-                    if not triggers[person_id]:
-                        triggers[person_id] = True
-                        start_times[person_id] = current_time
-                    elapsed_time = current_time - start_times[person_id]
-                    text = f"Duration : {int(elapsed_time)}s"
-                    cv2.putText(
-                        frame,
-                        text,
-                        (int(x_max) - 100, int(y_min) - 10),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255)
-                    )
-                    if int(elapsed_time) >= 10 and not notifications[person_id]: 
-                        # api_post = api_post_template
-                        # api_post["event_date"] = datetime.datetime.now().isoformat()
-                        # resized_frame = cv2.resize(frame, (0, 0), fx=0.5, fy=0.5)
-                        # _, buffer = cv2.imencode('.jpg', resized_frame)
-                        # api_post["image"] = base64.b64encode(buffer).decode('utf-8')
-                        print("Notification triggered")
-                        notifications[person_id] = True
-                
-        cv2.imshow('frame', frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'): break
+            detections = tracker.update(model.predict(frame, verbose=False)[0], frame)
+            detections = packages.update(frame, detections)
+            objects = filter_detections(detections, classes=(0, PACKAGE), tracked=True)
+            labels = []
+            alert = False
+            present = {int(i) for i in objects[:, ID]}
+            for x_min, y_min, x_max, y_max, id, confidence, class_id in objects:
+                track = tracks.update(int(id), current_time, (x_min, y_min, x_max, y_max), present)
+                elapsed_time = track.dwell(current_time)
+                labels.append(f"Duration : {int(elapsed_time)}s")
+                if int(elapsed_time) >= 10 and not track.alerted:
+                    alert = True
+                    track.alerted = True
+            tracks.evict(current_time)
+            draw_and_submit(alerts, api_post_template, frame, lambda f: draw(f, objects, labels), headless, alert)
+
+        if not headless:
+            cv2.imshow('frame', frame)
+            if cv2.waitKey(1) & 0xFF == ord('q'): break
     cap.release()
-    cv2.destroyAllWindows()
+    alerts.flush()
+    if not headless:
+        cv2.destroyAllWindows()
 
 if __name__ == '__main__':
     video = 'cctv/dropoff_loitering.mp4'
@@ -1,14 +1,45 @@
-import datetime
 import cv2
-import base64
-from ultralytics import YOLO
-from collections import defaultdict
+from gating import MotionGate
+from zones import ZoneMask, crop, crop_rect, offset_boxes
+from alerts import default_dispatcher, draw_and_submit
+from backends import get_model
+from engine import StreamTracker
+from tracks import TrackStore
+from filtering import CLASS_ID, ID, filter_detections, to_numpy
 
-def loading_bay(video):
-    model = YOLO("weights/yolov9m.pt")
+# bottom-left of the view (x < 80% of width, y > 35% of height)
+LOADING_BAY = [(0, 0.35), (0.8, 0.35), (0.8, 1), (0, 1)]
+
+def draw(frame, cars, no_cars):
+    cv2.putText(
+        frame,
+        f"Number of cars: {no_cars}",
+        (0, 50),
+        cv2.FONT_HERSHEY_SIMPLEX, 1.5, (255, 255, 255), 4
+    )
+    for x_min, y_min, x_max, y_max, id, *_ in cars:
+        cv2.putText(
+            frame,
+            f"({int(id)})",
+            (int(x_min), int(y_min) - 10),
+            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2
+        )
+        cv2.rectangle(
+            frame,
+            (int(x_min), int(y_min)),
+            (int(x_max), int(y_max)),
+            (255, 0, 0), 4
+        )
+    return frame
+
+def loading_bay(video, motion_gate=None, crop_to_zone=False, headless=False, alerts=None):
+    model = get_model("weights/yolov9m.pt")
     cap = cv2.VideoCapture(video)
-    notifications = defaultdict(lambda: False)
+    tracks = TrackStore(grace=5.0)
     fps = cap.get(cv2.CAP_PROP_FPS)
+    tracker = StreamTracker(fps)
+    detections = None
+    zone = None
     
     api_post_template = {
         "building": "AP",
@@ -17,6 +48,7 @@ def loading_bay(video):
         "event_type": "SC02",
         "image": None,
     }
+    alerts = default_dispatcher(alerts)
     
     while cap.isOpened():
         ret, frame = cap.read()
@@ -25,59 +57,41 @@ def loading_bay(video):
         current_time = current_frame / fps
         if current_frame % 3 == 0:
             
-            height, width = frame.shape[:2]            
-            ## width < 0.8
-            ## height > 0.35
-            
-            results = model.track(frame, persist=True, verbose=False)
-            detections = results[0].boxes.data
-            no_cars = len([d for d in detections if d[-1] == 2])
-            cv2.putText(
-                frame,
-                f"Number of cars: {no_cars}",
-                (0, 50),
-                cv2.FONT_HERSHEY_SIMPLEX, 1.5, (255, 255, 255), 4
-            )
-            for detection in detections:
-                if len(detection) == 7:
-                    x_min, y_min, x_max, y_max, id, confidence, class_id = detection
+            if zone is None:
+                zone = ZoneMask([LOADING_BAY], frame.shape, relative=True)
+
+            # static scene: reuse the previous detections (see gating.MotionGate)
+            if motion_gate is None or detections is None or motion_gate.check(frame, current_time):
+                if crop_to_zone:
+                    # only the loading bay is sent to the model
+                    rect = crop_rect(zone.bounds(), frame.shape)
+                    cropped = crop(frame, rect)
+                    results = model.predict(cropped, verbose=False)
+                    detections = to_numpy(offset_boxes(tracker.update(results[0], cropped), rect[0], rect[1]))
                 else:
-                    x_min, y_min, x_max, y_max, confidence, class_id = detection
-                    id = None
-                if id and int(class_id) == 2:
-                    
-                    car_pos = (int((x_max+x_min)//2), int(y_max))
-                    x, y = car_pos
-                    
-                    if x < width * 0.8 and y > height * 0.35:
-                        car_id = int(id)
-                        cv2.putText(
-                            frame,
-                            f"({int(id)})",
-                            (int(x_min), int(y_min) - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2
-                        )
-                        cv2.rectangle(
-                            frame,
-                            (int(x_min), int(y_min)),
-                            (int(x_max), int(y_max)),
-                            (255, 0, 0), 4
-                        )
-                        if not notifications[car_id]:
-                            api_post = api_post_template
-                            api_post['event_date'] = datetime.datetime.now().isoformat()
-                            resized_frame = cv2.resize(frame, (0, 0), fx=0.5, fy=0.5)
-                            _, buffer = cv2.imencode('.jpg', resized_frame)
-                            api_post["image"] = base64.b64encode(buffer).decode('utf-8')
-                            print(api_post)
-                            notifications[car_id] = True
-                            
-            cv2.imshow('frame', frame)
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
+                    results = model.predict(frame, verbose=False)
+                    detections = tracker.update(results[0], frame)
+            no_cars = int((detections[:, CLASS_ID] == 2).sum())
+            cars = filter_detections(detections, classes=(2,), zone=zone, tracked=True)
+            alert = False
+            present = {int(i) for i in cars[:, ID]}
+            for x_min, y_min, x_max, y_max, car_id, *_ in cars:
+                track = tracks.update(int(car_id), current_time, (x_min, y_min, x_max, y_max), present)
+                if not track.alerted:
+                    alert = True
+                    track.alerted = True
+            tracks.evict(current_time)
+            draw_and_submit(alerts, api_post_template, frame, lambda f: draw(f, cars, no_cars), headless, alert)
+
+            if not headless:
+                cv2.imshow('frame', frame)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
     cap.release()
-    cv2.destroyAllWindows()
+    alerts.flush()
+    if not headless:
+        cv2.destroyAllWindows()
     
 if __name__ == '__main__':
     video = 'revsc3.mp4'
-    results = loading_bay(video)
+    results = loading_bay(video, motion_gate=MotionGate())
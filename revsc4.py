@@ -1,13 +1,53 @@
-from ultralytics import YOLO
+from backends import get_model
+from engine import StreamTracker
 import datetime
 import cv2 as cv
-import base64
+from alerts import default_dispatcher, draw_and_submit
+from filtering import filter_detections
+from schedule import Governor, Schedule
 
-def nightwatch(video):
-    model = YOLO("weights/yolov9m.pt")
+def draw(frame, people, intruder, time_str):
+    cv.putText(
+        frame,
+        f"Current time: {time_str}",
+        (50, 50),
+        cv.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2
+    )
+    color = (0, 0, 255) if intruder else (255, 0, 0)
+    for x_min, y_min, x_max, y_max, id, *_ in people:
+        cv.putText(
+            frame,
+            f"({int(id)})",
+            (int(x_min), int(y_min) - 10),
+            cv.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2
+        )
+        cv.rectangle(
+            frame,
+            (int(x_min), int(y_min)),
+            (int(x_max), int(y_max)),
+            color, 4
+        )
+        if intruder:
+            cv.putText(
+                frame,
+                "intruder",
+                (int(x_max) - 100, int(y_min) - 10),
+                cv.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2
+            )
+    return frame
+
+# everyone should have left by 18:00; outside the window the camera only
+# runs a keep-alive inference every 30s
+NIGHT = [{"start": "18:00", "end": "06:00", "stride": 3}]
+
+def nightwatch(video, motion_gate=None, headless=False, alerts=None, schedule=None, clock=datetime.datetime.now):
+    model = get_model("weights/yolov9m.pt")
     cap = cv.VideoCapture(video)
-    current_hour, time_str = int(datetime.datetime.now().hour), datetime.datetime.now().strftime("%H:%m")
-    # current_hour, time_str = 19, "19:04"
+    fps = cap.get(cv.CAP_PROP_FPS)
+    tracker = StreamTracker(fps)
+    detections = None
+    # the clock is re-read as the video runs, not once at startup
+    governor = Governor(schedule or Schedule(NIGHT, outside="keepalive"), clock=clock)
     notification = False
 
     api_post_template = {
@@ -17,57 +57,30 @@ def nightwatch(video):
         "event_type": "SC02",
         "image": None,
     }
+    alerts = default_dispatcher(alerts)
 
     while cap.isOpened():
-        ret, frame = cap.read()
+        current_frame = int(cap.get(cv.CAP_PROP_POS_FRAMES)) + 1
+        sampled = governor.sample(current_frame, current_frame / fps)
+        # frames the schedule skips are grabbed, never decoded
+        ret, frame = cap.read() if sampled else (cap.grab(), None)
         if not ret: break
-        current_frame = int(cap.get(cv.CAP_PROP_POS_FRAMES))
-        if current_frame % 3 == 0:
-            results = model.track(frame, persist=True, verbose=False)
-            detections = results[0].boxes.data
-            cv.putText(
-                frame,
-                f"Current time: {time_str}",
-                (50, 50),
-                cv.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2
-            )
-            for detection in detections:
-                if len(detection) == 7:
-                    x_min, y_min, x_max, y_max, id, confidence, class_id = detection
-                else:
-                    x_min, y_min, x_max, y_max, confidence, class_id = detection
-                    id = None
-                if confidence > 0.55 and int(class_id) == 0:
-                    person_id = int(id)
-                    color = (255, 0, 0) if current_hour < 18 else (0, 0, 255) 
-                    cv.putText(
-                        frame,
-                        f"({int(id)})",
-                        (int(x_min), int(y_min) - 10),
-                        cv.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2
-                    )
-                    cv.rectangle(
-                        frame,
-                        (int(x_min), int(y_min)),
-                        (int(x_max), int(y_max)),
-                        color, 4
-                    )
-                    if current_hour > 18: # assuming 6pm is the cutoff for when everyone should leave
-                        cv.putText(
-                            frame,
-                            "intruder",
-                            (int(x_max) - 100, int(y_min) - 10),
-                            cv.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2
-                        )
-                        if not notification: 
-                            api_post = api_post_template
-                            api_post["event_date"] = datetime.datetime.now().isoformat()
-                            resized_frame = cv.resize(frame, (0, 0), fx=0.5, fy=0.5)
-                            _, buffer = cv.imencode('.jpg', resized_frame)
-                            api_post["image"] = base64.b64encode(buffer).decode('utf-8')
-                            print(api_post_template)
-                            notification = True
-            cv.imshow('frame', frame)
-            if cv.waitKey(1) & 0xFF == ord('q'): break
+        if sampled:
+            time_str = clock().strftime("%H:%M")
+            # static scene: reuse the previous detections (see gating.MotionGate)
+            if motion_gate is None or detections is None or motion_gate.check(frame, current_frame / fps):
+                results = model.predict(frame, verbose=False)
+                detections = tracker.update(results[0], frame)
+            people = filter_detections(detections, confidence=0.55, classes=(0,), tracked=True)
+            intruder = governor.active
+            alert = intruder and len(people) > 0 and not notification
+            draw_and_submit(alerts, api_post_template, frame, lambda f: draw(f, people, intruder, time_str), headless, alert)
+            if alert:
+                notification = True
+            if not headless:
+                cv.imshow('frame', frame)
+                if cv.waitKey(1) & 0xFF == ord('q'): break
     cap.release()
-    cv.destroyAllWindows()
+    alerts.flush()
+    if not headless:
+        cv.destroyAllWindows()
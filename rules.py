@@ -0,0 +1,161 @@
+import datetime
+
+from zones import ZoneMask
+from filtering import ID, filter_detections
+from tracks import TrackStore
+
+class Rule:
+    # a rule selects its own class/zone/confidence from the shared per-frame
+    # detections and decides whether to fire. evaluate() returns
+    # (selected detections, one label per detection, fired)
+    # attributes carried over when a camera moves to another process
+    STATE = ()
+
+    def __init__(self, event_type, classes, confidence=0.5, zone=None, zones=None, relative=False):
+        self.event_type = event_type
+        self.classes = tuple(classes)
+        self.confidence = confidence
+        self.zones = zones or ([zone] if zone else None)
+        self.relative = relative
+        self.zone_masks = {}
+
+    def zone_mask(self, frame):
+        if not self.zones:
+            return None
+        shape = frame.shape[:2]
+        if shape not in self.zone_masks:
+            self.zone_masks[shape] = ZoneMask(self.zones, shape, self.relative)
+        return self.zone_masks[shape]
+
+    def select(self, frame, detections):
+        return filter_detections(detections, self.confidence, self.classes, self.zone_mask(frame))
+
+    def reset(self):
+        pass
+
+    def state(self):
+        return {name: getattr(self, name) for name in self.STATE}
+
+    def restore(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        # the restored tracks came from another tracker instance
+        if "tracks" in state:
+            self.tracks.detach()
+
+    def evaluate(self, frame, detections, current_time):
+        raise NotImplementedError
+
+class DwellRule(Rule):
+    # an object stays for longer than max_time (revsc1, revsc2, ActivityMonitor)
+    STATE = ("tracks",)
+
+    def __init__(self, event_type, classes, max_time=10, grace=5.0, reassociate_iou=0.5, **kwargs):
+        super().__init__(event_type, classes, **kwargs)
+        self.max_time = max_time
+        self.grace = grace
+        self.reassociate_iou = reassociate_iou
+        self.reset()
+
+    def reset(self):
+        self.tracks = TrackStore(self.grace, self.reassociate_iou)
+
+    def evaluate(self, frame, detections, current_time):
+        selected = self.select(frame, detections)
+        labels = []
+        fired = False
+        present = {int(i) for i in selected[:, ID] if i >= 0}
+        for x_min, y_min, x_max, y_max, obj_id, *_ in selected:
+            obj_id = int(obj_id) if obj_id >= 0 else None
+            track = self.tracks.update(obj_id, current_time, (x_min, y_min, x_max, y_max), present)
+            elapsed_time = track.dwell(current_time)
+            labels.append(f"Duration: {int(elapsed_time)}s")
+            if elapsed_time >= self.max_time and not track.alerted:
+                fired = track.alerted = True
+        self.tracks.evict(current_time)
+        return selected, labels, fired
+
+class ZoneIntrusionRule(Rule):
+    # any tracked object of the class inside the zone fires once (revsc3)
+    STATE = ("tracks",)
+
+    def __init__(self, event_type, classes, grace=5.0, **kwargs):
+        super().__init__(event_type, classes, **kwargs)
+        self.grace = grace
+        self.reset()
+
+    def reset(self):
+        self.tracks = TrackStore(self.grace)
+
+    def evaluate(self, frame, detections, current_time):
+        selected = self.select(frame, detections)
+        selected = selected[selected[:, ID] >= 0]
+        fired = False
+        present = {int(i) for i in selected[:, ID]}
+        for x_min, y_min, x_max, y_max, obj_id, *_ in selected:
+            track = self.tracks.update(int(obj_id), current_time, (x_min, y_min, x_max, y_max), present)
+            if not track.alerted:
+                fired = track.alerted = True
+        self.tracks.evict(current_time)
+        return selected, ["intruder"] * len(selected), fired
+
+class TimeWindowRule(ZoneIntrusionRule):
+    # presence between start and end (wall-clock hours, may wrap past
+    # midnight) fires once per track (revsc4). clock is re-read every frame.
+    def __init__(self, event_type, classes, start=18, end=6, clock=datetime.datetime.now, **kwargs):
+        super().__init__(event_type, classes, **kwargs)
+        self.start = start
+        self.end = end
+        self.clock = clock
+
+    def active(self):
+        hour = self.clock().hour
+        if self.start <= self.end:
+            return self.start <= hour < self.end
+        return hour >= self.start or hour < self.end
+
+    def evaluate(self, frame, detections, current_time):
+        if not self.active():
+            return self.select(frame, detections)[:0], [], False
+        return super().evaluate(frame, detections, current_time)
+
+class OccupancyRule(Rule):
+    # more than max_count objects for at least duration seconds (revsc5)
+    STATE = ("start_time", "alerted")
+
+    def __init__(self, event_type, classes, max_count=8, duration=10, **kwargs):
+        super().__init__(event_type, classes, **kwargs)
+        self.max_count = max_count
+        self.duration = duration
+        self.reset()
+
+    def reset(self):
+        self.start_time = None
+        self.alerted = False
+
+    def evaluate(self, frame, detections, current_time):
+        selected = self.select(frame, detections)
+        if len(selected) <= self.max_count:
+            self.reset()
+            return selected, [], False
+        if self.start_time is None:
+            self.start_time = current_time
+        elapsed_time = current_time - self.start_time
+        fired = elapsed_time >= self.duration and not self.alerted
+        self.alerted = self.alerted or fired
+        return selected, [], fired
+
+RULES = {
+    "dwell": DwellRule,
+    "zone": ZoneIntrusionRule,
+    "time_window": TimeWindowRule,
+    "occupancy": OccupancyRule,
+}
+
+def rules_from_config(config):
+    # config: [{"type": "dwell", "event_type": "SC02", "classes": [2], "max_time": 10, ...}, ...]
+    rules = []
+    for entry in config:
+        entry = dict(entry)
+        rules.append(RULES[entry.pop("type")](**entry))
+    return rules
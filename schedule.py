@@ -0,0 +1,110 @@
+import datetime
+import math
+import time
+
+MODES = ("on", "keepalive", "off")
+
+def minutes(value):
+    # "18:30" -> 1110; plain numbers are hours
+    if isinstance(value, str):
+        hours, _, mins = value.partition(":")
+        return int(hours) * 60 + int(mins or 0)
+    return int(value * 60)
+
+class Window:
+    # a daily time window, continuous to the minute and allowed to wrap
+    # past midnight. days are weekdays (0 = Monday) on which it starts.
+    #   mode       "on" runs the detector every `stride` frames,
+    #              "keepalive" once every `keepalive` seconds, "off" never
+    #   imgsz      inference size while the window is active (None: model default)
+    #   min_stride lowest stride the engine may boost to while other
+    #              cameras are idle (defaults to stride: no boost)
+    def __init__(self, start="00:00", end="24:00", days=None, mode="on", stride=3, imgsz=None, min_stride=None,
+                 keepalive=30.0):
+        if mode not in MODES:
+            raise ValueError(f"unknown schedule mode: {mode}")
+        self.start = minutes(start)
+        self.end = minutes(end)
+        self.days = None if days is None else set(days)
+        self.mode = mode
+        self.stride = stride
+        self.imgsz = imgsz
+        self.min_stride = stride if min_stride is None else min_stride
+        self.keepalive = keepalive
+
+    def contains(self, now):
+        minute = now.hour * 60 + now.minute
+        if self.start <= self.end:
+            inside, day = self.start <= minute < self.end, now.weekday()
+        elif minute >= self.start:
+            inside, day = True, now.weekday()
+        else:
+            # the early-morning part belongs to the previous day's window
+            inside, day = minute < self.end, (now.weekday() - 1) % 7
+        return inside and (self.days is None or day in self.days)
+
+class Schedule:
+    # the first window containing the current time applies; outside all of
+    # them the camera falls back to `outside` ("keepalive" or "off")
+    def __init__(self, windows, outside="off", keepalive=30.0):
+        self.windows = [w if isinstance(w, Window) else Window(**w) for w in windows]
+        self.outside = Window(mode=outside, keepalive=keepalive)
+
+    def current(self, now):
+        for window in self.windows:
+            if window.contains(now):
+                return window
+        return self.outside
+
+class Governor:
+    # a camera's schedule, re-read from the clock at most every
+    # `check_every` wall seconds, turned into a per-frame decision
+    def __init__(self, schedule, clock=datetime.datetime.now, check_every=1.0):
+        self.schedule = schedule if isinstance(schedule, Schedule) else Schedule(schedule)
+        self.clock = clock
+        self.check_every = check_every
+        self.checked = None
+        self.window = None
+        self.last_run = None
+        # fraction of the engine's cameras currently active (set by the engine)
+        self.share = 1.0
+        self.update()
+
+    def reset(self):
+        self.last_run = None
+
+    def update(self):
+        now = time.monotonic()
+        if self.checked is None or now - self.checked >= self.check_every:
+            self.checked = now
+            window = self.schedule.current(self.clock())
+            if window is not self.window:
+                self.window = window
+                self.last_run = None
+        return self.window
+
+    @property
+    def active(self):
+        return self.window.mode == "on"
+
+    @property
+    def imgsz(self):
+        return self.window.imgsz
+
+    @property
+    def stride(self):
+        # cameras left running get the CPU freed by idle ones, down to min_stride
+        window = self.window
+        return max(window.min_stride, math.ceil(window.stride * self.share))
+
+    def sample(self, current_frame, current_time):
+        # current_frame counts from 1, as cv.CAP_PROP_POS_FRAMES after a read
+        window = self.update()
+        if window.mode == "off":
+            return False
+        if window.mode == "keepalive":
+            if self.last_run is not None and current_time - self.last_run < window.keepalive:
+                return False
+            self.last_run = current_time
+            return True
+        return current_frame % self.stride == 0
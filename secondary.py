@@ -0,0 +1,133 @@
+import cv2 as cv
+import numpy as np
+
+from filtering import CLASS_ID, CONFIDENCE, ID, to_numpy
+from tracks import iou
+from zones import crop, crop_rect, offset_boxes
+
+class SecondaryModel:
+    # a specialised detector attached to a camera at its own rate:
+    #   every         run on every Nth call only
+    #   when_present  only run when the primary sees one of these classes
+    #   around        run on padded crops around those primary classes,
+    #                 batched into one forward pass at crop_imgsz, instead of
+    #                 the full frame; once the crops add up to full_frame of
+    #                 the frame's area a single full-frame pass is cheaper
+    # class ids are shifted by class_offset so they don't collide with the
+    # primary model's, and results are held for `hold` calls after a run.
+    def __init__(self, model, every=5, when_present=None, around=None, crop_pad=0.25, confidence=0.25,
+                 class_offset=100, imgsz=640, match_iou=0.3, id_offset=1_000_000, hold=None, crop_imgsz=320,
+                 full_frame=0.5):
+        self.model = model
+        self.every = every
+        self.when_present = when_present
+        self.around = around
+        self.crop_pad = crop_pad
+        self.confidence = confidence
+        self.class_offset = class_offset
+        self.imgsz = imgsz
+        self.crop_imgsz = crop_imgsz
+        self.full_frame = full_frame
+        self.match_iou = match_iou
+        # keeps secondary ids clear of the primary tracker's
+        self.id_offset = id_offset
+        self.hold = hold if hold is not None else every * 2
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.last_run = 0
+        self.runs = 0
+        self.next_id = self.id_offset
+        self.last = np.zeros((0, 7), dtype=np.float32)
+
+    def due(self, detections):
+        self.calls += 1
+        run = (self.calls - 1) % self.every == 0
+        if run and self.when_present is not None:
+            run = bool(np.isin(detections[:, CLASS_ID].astype(np.int32), self.when_present).any())
+        if not run and self.calls - self.last_run > self.hold:
+            self.last = self.last[:0]
+        return run
+
+    def regions(self, frame, detections):
+        if self.around is None:
+            return [None]
+        anchors = detections[np.isin(detections[:, CLASS_ID].astype(np.int32), self.around)]
+        h, w = frame.shape[:2]
+        rects = []
+        for x_min, y_min, x_max, y_max, *_ in anchors:
+            # pad relative to the box, not the frame
+            bw, bh = x_max - x_min, y_max - y_min
+            box = (x_min - bw * self.crop_pad, y_min - bh * self.crop_pad, x_max + bw * self.crop_pad, y_max + bh * self.crop_pad)
+            rects.append(crop_rect([box], (h, w), pad=0))
+        # each crop is letterboxed to crop_imgsz: once they cover most of
+        # the frame, or their inputs add up to one imgsz input, a single
+        # full-frame pass costs less than all of them
+        area = sum((r[2] - r[0]) * (r[3] - r[1]) for r in rects)
+        if len(rects) * self.crop_imgsz ** 2 >= self.imgsz ** 2 or area >= self.full_frame * h * w:
+            return [None]
+        return rects
+
+    def run(self, frame, detections):
+        rects = [r for r in self.regions(frame, detections) if r is None or (r[2] > r[0] and r[3] > r[1])]
+        if not rects:
+            self.last = self.last[:0]
+            return self.last
+        images = [frame if r is None else crop(frame, r) for r in rects]
+        imgsz = self.imgsz if rects == [None] else self.crop_imgsz
+        results = self.model.predict(images, imgsz=imgsz, conf=self.confidence, verbose=False)
+        found = []
+        for rect, result in zip(rects, results):
+            boxes = to_numpy(result.boxes.data)
+            found.append(boxes if rect is None else offset_boxes(boxes, rect[0], rect[1]))
+        found = np.concatenate(found)
+        if len(rects) > 1 and len(found) > 1:
+            # overlapping crops see the same object more than once
+            keep = cv.dnn.NMSBoxes(
+                [(float(b[0]), float(b[1]), float(b[2] - b[0]), float(b[3] - b[1])) for b in found],
+                [float(c) for c in found[:, CONFIDENCE]], self.confidence, 0.5)
+            found = found[np.asarray(keep, dtype=np.int64).reshape(-1)]
+        found[:, CLASS_ID] += self.class_offset
+        self.last_run = self.calls
+        self.runs += 1
+        self.last = self.assign_ids(found)
+        return self.last
+
+    def assign_ids(self, found):
+        # greedy IoU match against the previous run so ids persist between
+        # runs; the primary tracker never sees these boxes
+        previous = list(self.last)
+        for det in found:
+            best, best_iou = None, self.match_iou
+            for i, prev in enumerate(previous):
+                if prev[CLASS_ID] != det[CLASS_ID]:
+                    continue
+                overlap = iou(prev, det)
+                if overlap >= best_iou:
+                    best, best_iou = i, overlap
+            if best is None:
+                det[ID] = self.next_id
+                self.next_id += 1
+            else:
+                det[ID] = previous.pop(best)[ID]
+        return found
+
+class SecondaryScheduler:
+    def __init__(self, secondaries):
+        self.secondaries = list(secondaries)
+
+    def reset(self):
+        for secondary in self.secondaries:
+            secondary.reset()
+
+    def update(self, frame, detections):
+        # returns the primary detections with every secondary's latest
+        # (possibly held) detections appended
+        detections = to_numpy(detections)
+        merged = [detections]
+        for secondary in self.secondaries:
+            if secondary.due(detections):
+                secondary.run(frame, detections)
+            merged.append(secondary.last)
+        return np.concatenate(merged) if len(merged) > 1 else detections
@@ -0,0 +1,70 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+from alerts import AlertDispatcher
+
+class Endpoint(BaseHTTPRequestHandler):
+    # records every posted body; status and delay are set by the test
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(self.server.delay)
+        self.server.received.append(body)
+        self.send_response(self.server.status)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def endpoint():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Endpoint)
+    server.status, server.delay, server.received = 200, 0.0, []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def dispatcher(endpoint, tmp_path):
+    alerts = AlertDispatcher(f"http://127.0.0.1:{endpoint.server_address[1]}/", spool_path=str(tmp_path / "alerts.spool"),
+                             retries=0, backoff=0, timeout=5, verbose=False)
+    yield alerts
+    alerts.close()
+
+def frame():
+    return np.zeros((48, 64, 3), dtype=np.uint8)
+
+def test_failed_alert_is_spooled_then_replayed(endpoint, dispatcher):
+    endpoint.status = 500
+    dispatcher.submit({"event_type": "SC02", "ids": [1]}, frame())
+    dispatcher.flush()
+    with open(dispatcher.spool_path) as f:
+        spooled = [json.loads(line) for line in f]
+    assert [payload["ids"] for payload in spooled] == [[1]]
+    assert spooled[0]["image"]
+    assert dispatcher.sent == 0
+
+    endpoint.status = 200
+    dispatcher.submit({"event_type": "SC02", "ids": [2]}, frame())
+    dispatcher.flush()
+    # the spooled alert went out after the next successful one
+    assert [body["ids"] for body in endpoint.received[-2:]] == [[2], [1]]
+    assert not os.path.exists(dispatcher.spool_path)
+    assert not os.path.exists(dispatcher.spool_path + ".replay")
+    assert dispatcher.sent == 2
+
+def test_submit_does_not_wait_for_delivery(endpoint, dispatcher):
+    endpoint.delay = 0.3
+    start = time.perf_counter()
+    for i in range(5):
+        dispatcher.submit({"event_type": "SC02", "ids": [i]}, frame())
+    assert time.perf_counter() - start < 0.1
+    dispatcher.flush()
+    assert [body["ids"] for body in endpoint.received] == [[i] for i in range(5)]
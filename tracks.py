@@ -0,0 +1,83 @@
+class Track:
+    __slots__ = ("track_id", "first_seen", "last_seen", "alerted", "box")
+
+    def __init__(self, track_id, current_time, box=None):
+        self.track_id = track_id
+        self.first_seen = current_time
+        self.last_seen = current_time
+        self.alerted = False
+        self.box = box
+
+    def dwell(self, current_time):
+        return current_time - self.first_seen
+
+def iou(a, b):
+    x_min, y_min = max(a[0], b[0]), max(a[1], b[1])
+    x_max, y_max = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x_max - x_min) * max(0.0, y_max - y_min)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+class TrackStore:
+    # one record per live track instead of three ever-growing dicts keyed by
+    # tracker id. tracks unseen for `grace` seconds are evicted, so memory is
+    # bounded by the number of concurrent objects. a new id whose box overlaps
+    # a track lost within the grace period takes over that track's dwell time;
+    # `present` (the frame's ids) keeps tracks still in view from being taken.
+    def __init__(self, grace=5.0, reassociate_iou=0.5):
+        self.grace = grace
+        self.reassociate_iou = reassociate_iou
+        self.tracks = {}
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def __contains__(self, track_id):
+        return track_id in self.tracks
+
+    def get(self, track_id):
+        return self.tracks.get(track_id)
+
+    def update(self, track_id, current_time, box=None, present=()):
+        track = self.tracks.get(track_id)
+        if track is None:
+            track = self.reassociate(track_id, current_time, box, present) or Track(track_id, current_time, box)
+            self.tracks[track_id] = track
+        track.last_seen = current_time
+        track.box = None if box is None else tuple(float(v) for v in box[:4])
+        return track
+
+    def reassociate(self, track_id, current_time, box, present=()):
+        if box is None or track_id is None or not self.reassociate_iou:
+            return None
+        best, best_iou = None, self.reassociate_iou
+        for track in self.tracks.values():
+            # only tracks that are actually lost, not merely not updated yet this frame
+            if track.last_seen >= current_time or track.box is None or track.track_id is None or track.track_id in present:
+                continue
+            overlap = iou(track.box, box)
+            if overlap >= best_iou:
+                best, best_iou = track, overlap
+        if best is not None:
+            del self.tracks[best.track_id]
+            best.track_id = track_id
+        return best
+
+    def evict(self, current_time):
+        expired = [k for k, t in self.tracks.items() if current_time - t.last_seen > self.grace]
+        for k in expired:
+            del self.tracks[k]
+        return len(expired)
+
+    def detach(self):
+        # after a tracker restart its ids mean nothing: re-key every track
+        # with an id the tracker never produces, so fresh ids only inherit
+        # dwell time through IoU reassociation within the grace period
+        tracks = list(self.tracks.values())
+        self.tracks = {}
+        for i, track in enumerate(tracks):
+            track.track_id = -1 - i
+            self.tracks[track.track_id] = track
+
+    def clear(self):
+        self.tracks.clear()
@@ -0,0 +1,56 @@
+import cv2 as cv
+import numpy as np
+
+def crop_rect(zones, frame_shape, pad=0.1):
+    # padded bounding rectangle of all zones (x_min, y_min, x_max, y_max),
+    # clipped to the frame. pad is a fraction of the frame size per side so
+    # objects whose anchor point sits inside a zone are not cut off.
+    h, w = frame_shape[:2]
+    px, py = int(w * pad), int(h * pad)
+    x_min = min(z[0] for z in zones) - px
+    y_min = min(z[1] for z in zones) - py
+    x_max = max(z[2] for z in zones) + px
+    y_max = max(z[3] for z in zones) + py
+    return max(0, int(x_min)), max(0, int(y_min)), min(w, int(x_max)), min(h, int(y_max))
+
+def crop(frame, rect):
+    x_min, y_min, x_max, y_max = rect
+    return frame[y_min:y_max, x_min:x_max]
+
+def offset_boxes(data, x_offset, y_offset):
+    # map boxes from crop back to frame coordinates (numpy array or torch tensor)
+    if not x_offset and not y_offset:
+        return data
+    data = data.clone() if hasattr(data, "clone") else data.copy()
+    data[:, [0, 2]] += x_offset
+    data[:, [1, 3]] += y_offset
+    return data
+
+def rect_polygon(rect):
+    x_min, y_min, x_max, y_max = rect
+    return [(x_min, y_min), (x_max, y_min), (x_max, y_max), (x_min, y_max)]
+
+def polygon_bounds(polygon):
+    xs = [p[0] for p in polygon]
+    ys = [p[1] for p in polygon]
+    return min(xs), min(ys), max(xs), max(ys)
+
+class ZoneMask:
+    # zones rasterised once per camera/frame size; membership of a point is
+    # then a single array lookup. relative=True takes coordinates as
+    # fractions of the frame width/height.
+    def __init__(self, polygons, frame_shape, relative=False):
+        h, w = frame_shape[:2]
+        scale = np.array([w, h], dtype=np.float32) if relative else np.ones(2, dtype=np.float32)
+        self.polygons = [np.asarray(p, dtype=np.float32) * scale for p in polygons]
+        self.mask = np.zeros((h, w), dtype=np.uint8)
+        cv.fillPoly(self.mask, [np.round(p).astype(np.int32) for p in self.polygons], 1)
+
+    def bounds(self):
+        return [polygon_bounds(p) for p in self.polygons]
+
+    def contains(self, x, y):
+        h, w = self.mask.shape
+        xs = np.clip(np.asarray(x).astype(np.int32), 0, w - 1)
+        ys = np.clip(np.asarray(y).astype(np.int32), 0, h - 1)
+        return self.mask[ys, xs].astype(bool)